@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from uuid import UUID
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
+
+from .pipeline import fetch_paper_rows, process_paper_text
+
+logger = logging.getLogger('grobid_batch')
+
+# Papers processed at once in a batch; per-stage limits are applied in the pipeline
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "16"))
+
+
+def _process_batch_item(paper_id: str, data: dict) -> dict:
+    if data is None:
+        return {"id": paper_id, "success": False, "message": f"No data found for id: {paper_id}"}
+
+    try:
+        result = process_paper_text(paper_id, data)
+    except Exception as e:
+        logger.error(f"Failed to process {paper_id}: {str(e)}")
+        return {"id": paper_id, "success": False, "message": str(e)}
+
+    return {
+        "id": paper_id,
+        "success": True,
+        "message": result["extraction_result"]["message"],
+        "divisions": result["division_count"]
+    }
+
+
+def iter_process_batch(ids: list, workers: int = BATCH_WORKERS) -> Iterator[dict]:
+    """
+    Process many papers, yielding one result per paper as soon as it finishes.
+
+    Args:
+        ids (list): Paper ids as strings
+        workers (int): Number of papers in flight at once
+
+    Yields:
+        dict: Per-paper result with id, success and message
+    """
+    ids = list(dict.fromkeys(ids))
+    rows = fetch_paper_rows(ids)
+    logger.info(f"Processing batch of {len(ids)} papers, {len(rows)} found")
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    try:
+        futures = [pool.submit(_process_batch_item, paper_id, rows.get(paper_id)) for paper_id in ids]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Stop queued papers if the consumer goes away, e.g. a client disconnect
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_process_batch_ndjson(ids: list, workers: int = BATCH_WORKERS) -> Iterator[str]:
+    for result in iter_process_batch(ids, workers):
+        yield json.dumps(result) + "\n"
+
+
+# Example usage: python -m app.batch ids.txt
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process many papers through GROBID")
+    parser.add_argument("ids_file", nargs="?", help="File with one paper id per line (default: stdin)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    args = parser.parse_args()
+
+    ids_file = open(args.ids_file) if args.ids_file else sys.stdin
+    with ids_file:
+        paper_ids = [line.strip() for line in ids_file if line.strip()]
+
+    # Normalize ids like the HTTP endpoint does; a malformed id would fail the whole
+    # `in` query of its chunk, so it is reported on its own line instead
+    valid_ids = []
+    for paper_id in paper_ids:
+        try:
+            valid_ids.append(str(UUID(paper_id)))
+        except ValueError:
+            sys.stdout.write(json.dumps({"id": paper_id, "success": False, "message": "Invalid UUID format"}) + "\n")
+
+    for line in iter_process_batch_ndjson(valid_ids, args.workers):
+        sys.stdout.write(line)
+        sys.stdout.flush()
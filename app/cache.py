@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from .metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger('result_cache')
+
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "./cache")
+# Total size of all cache entries before the least recently used ones are evicted
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+
+def file_sha256(path: str) -> str:
+    """
+    Compute the SHA-256 of a file without loading it into memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(pdf_hash: str, namespace: str, **config) -> str:
+    """
+    Build a cache key from the PDF content hash, the kind of result and everything
+    else the result depends on (service endpoints, versions, model settings).
+    """
+    payload = json.dumps({"pdf": pdf_hash, "namespace": namespace, "config": config}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of processing results with size-based LRU eviction.
+
+    Each key is a directory holding any number of named files (TEI, parsed divisions,
+    figure crops and metadata). Access times are tracked in memory and persisted through
+    the directory mtime, so the LRU order survives restarts.
+    """
+
+    def __init__(self, cache_dir: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self):
+        # Called with the lock held
+        if self._index is not None:
+            return
+        self._index = {}
+        if not os.path.isdir(self.cache_dir):
+            return
+        # Other worker processes may evict entries while they are being listed
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            try:
+                keys = os.listdir(prefix_dir)
+            except OSError:
+                continue
+            for key in keys:
+                try:
+                    atime = os.path.getmtime(os.path.join(prefix_dir, key))
+                except OSError:
+                    continue
+                self._index[key] = {"size": self._entry_size(key), "atime": atime}
+
+    def _entry_size(self, key: str) -> int:
+        entry_dir = self._entry_dir(key)
+        try:
+            names = os.listdir(entry_dir)
+        except OSError:
+            return 0
+        size = 0
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            try:
+                size += os.path.getsize(os.path.join(entry_dir, name))
+            except OSError:
+                pass
+        return size
+
+    def _touch(self, key: str):
+        # Called with the lock held
+        now = time.time()
+        self._index[key]["atime"] = now
+        try:
+            os.utime(self._entry_dir(key), (now, now))
+        except OSError:
+            pass
+
+    def _evict(self, keep: str):
+        # Called with the lock held
+        total = sum(entry["size"] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]["atime"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._index.pop(key)["size"]
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            self._evictions += 1
+            logger.info(f"Evicted cache entry {key}")
+
+    def get_bytes(self, key: str, name: str) -> Optional[bytes]:
+        """
+        Read a cached file. A file evicted while it is being read, possibly by another
+        worker process, counts as a miss.
+
+        Returns:
+            bytes: The file content, or None on a cache miss
+        """
+        path = os.path.join(self._entry_dir(key), name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+
+        with self._lock:
+            self._load_index()
+            if data is None:
+                self._misses += 1
+                CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._hits += 1
+            CACHE_LOOKUPS.labels("hit").inc()
+            if key not in self._index:
+                if not os.path.isdir(self._entry_dir(key)):
+                    return data
+                # Written by another worker process since the index was loaded
+                self._index[key] = {"size": self._entry_size(key), "atime": 0}
+            self._touch(key)
+        return data
+
+    def put_bytes(self, key: str, name: str, data: bytes):
+        """
+        Store a file under a cache key, evicting old entries if the cache is over size.
+        If the entry is evicted while it is being written, the result is not cached.
+        """
+        entry_dir = self._entry_dir(key)
+        path = os.path.join(entry_dir, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache {name} under {key}: {str(e)}")
+            return
+
+        with self._lock:
+            self._load_index()
+            entry = self._index.setdefault(key, {"size": 0, "atime": 0})
+            entry["size"] = self._entry_size(key)
+            self._touch(key)
+            self._evict(keep=key)
+
+    def get_json(self, key: str, name: str):
+        data = self.get_bytes(key, name)
+        return None if data is None else json.loads(data)
+
+    def put_json(self, key: str, name: str, value):
+        self.put_bytes(key, name, json.dumps(value).encode("utf-8"))
+
+    def stats(self) -> dict:
+        """
+        Get cache statistics.
+        """
+        with self._lock:
+            self._load_index()
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._index),
+                "bytes": sum(entry["size"] for entry in self._index.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+            }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,94 @@
+import bisect
+from typing import Optional, Sequence
+
+
+def horizontal_overlap(a: Sequence[float], b: Sequence[float]) -> float:
+    """
+    Horizontal overlap of two (x1, y1, x2, y2) boxes as a share of the narrower one.
+
+    Returns:
+        float: 0.0 for boxes side by side (e.g. in different columns), 1.0 when one
+        box spans the full width of the other
+    """
+    overlap = min(a[2], b[2]) - max(a[0], b[0])
+    narrower = min(a[2] - a[0], b[2] - b[0])
+    if overlap <= 0 or narrower <= 0:
+        return 0.0
+    return overlap / narrower
+
+
+class CaptionIndex:
+    """
+    Spatial index over the text blocks of one page that finds the nearest block
+    above or below a figure.
+
+    Blocks are kept sorted by their top edge (for "below" queries) and by their bottom
+    edge (for "above" queries). A query bisects to the figure's edge and walks away
+    from it only until max_distance is exceeded, instead of scanning and sorting every
+    block on the page for every figure.
+
+    Blocks only need a `coordinates` attribute holding (x1, y1, x2, y2).
+    """
+
+    def __init__(self, blocks: Sequence, min_overlap: float = 0.0):
+        """
+        Args:
+            blocks: Text blocks of the page
+            min_overlap (float): Minimum horizontal_overlap between a figure and a
+                matching block. Above 0, blocks in another column never match.
+        """
+        self.min_overlap = min_overlap
+        # Ties are broken by original block order, matching a stable sort
+        by_top = sorted(range(len(blocks)), key=lambda n: (blocks[n].coordinates[1], n))
+        self._below = [blocks[n] for n in by_top]
+        self._below_keys = [block.coordinates[1] for block in self._below]
+        by_bottom = sorted(range(len(blocks)), key=lambda n: (-blocks[n].coordinates[3], n))
+        self._above = [blocks[n] for n in by_bottom]
+        self._above_keys = [-block.coordinates[3] for block in self._above]
+
+    def _matches(self, box, block, max_height: float) -> bool:
+        coordinates = block.coordinates
+        return (
+            coordinates[3] - coordinates[1] < max_height
+            and horizontal_overlap(box, coordinates) >= self.min_overlap
+        )
+
+    def nearest_below(self, box: Sequence[float], max_distance: float, max_height: float) -> Optional[object]:
+        """
+        Find the closest block starting at or below the bottom of box.
+
+        Args:
+            box: (x1, y1, x2, y2) of the figure
+            max_distance (float): Maximum gap between the figure's bottom and the block's top
+            max_height (float): Blocks this tall or taller (e.g. whole paragraphs) are ignored
+
+        Returns:
+            The matching block, or None
+        """
+        bottom = box[3]
+        for n in range(bisect.bisect_left(self._below_keys, bottom), len(self._below)):
+            if self._below_keys[n] - bottom >= max_distance:
+                break
+            if self._matches(box, self._below[n], max_height):
+                return self._below[n]
+        return None
+
+    def nearest_above(self, box: Sequence[float], max_distance: float, max_height: float) -> Optional[object]:
+        """
+        Find the closest block ending at or above the top of box.
+
+        Args:
+            box: (x1, y1, x2, y2) of the figure
+            max_distance (float): Maximum gap between the block's bottom and the figure's top
+            max_height (float): Blocks this tall or taller (e.g. whole paragraphs) are ignored
+
+        Returns:
+            The matching block, or None
+        """
+        top = box[1]
+        for n in range(bisect.bisect_left(self._above_keys, -top), len(self._above)):
+            if top + self._above_keys[n] >= max_distance:
+                break
+            if self._matches(box, self._above[n], max_height):
+                return self._above[n]
+        return None
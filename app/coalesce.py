@@ -0,0 +1,106 @@
+import os
+import time
+import fcntl
+import inspect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+from .manifest import DOCUMENTS_DIR
+from .metrics import observe_stage, REQUESTS_COALESCED
+
+logger = logging.getLogger('coalesce')
+
+LOCK_NAME = ".lock"
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent identical calls within the process.
+
+    The first caller for a key runs the function; callers arriving while it runs wait
+    for it and get the same result or exception instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs), or join the call already running for key.
+
+        Args:
+            key (Hashable): Identifies calls that can share a result, e.g. the operation
+                and the document id along with any parameters that change the result
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            logger.info(f"Joining call already in flight for {key}")
+            REQUESTS_COALESCED.labels(str(key[0]) if isinstance(key, tuple) else str(key)).inc()
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+in_flight = SingleFlight()
+
+
+def coalesced(fn: Callable) -> Callable:
+    """
+    Decorator that shares one call of fn between concurrent callers passing the same
+    arguments, e.g. a request retried while the first attempt is still running.
+    Arguments must be hashable.
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return in_flight.do((fn.__name__,) + tuple(bound.arguments.items()), fn, *args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def document_lock(paper_id: str):
+    """
+    Hold the exclusive lock on a paper's document directory.
+
+    The lock is a file lock, so it also keeps other worker processes out. Work on a
+    paper's PDF and manifest (download, processing, inserts) happens under it, so a
+    duplicate request waits and then finds every stage already done.
+    """
+    doc_dir = os.path.join(DOCUMENTS_DIR, str(paper_id))
+    os.makedirs(doc_dir, exist_ok=True)
+    with open(os.path.join(doc_dir, LOCK_NAME), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(f"Waiting for another request working on document {paper_id}")
+            start = time.perf_counter()
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            observe_stage("document_lock_wait", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,57 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .coalesce import document_lock
+from .figure_extractor import process_local_figures
+from .manifest import StageManifest
+from .pipeline import download_paper, process_local_text
+
+logger = logging.getLogger('document_pipeline')
+
+
+def process_paper(paper_id: str, data: dict, bucket_name: str = "figure-images", force: bool = False,
+                  mode: str = None) -> dict:
+    """
+    Run the text and figure pipelines of one paper side by side.
+
+    The PDF is downloaded once, then GROBID -> TEI extraction -> insert runs in a worker
+    thread while the figure pipeline runs in the calling thread, both on the same local
+    file and stage manifest. One failing does not stop the other. The paper's document
+    lock is held throughout.
+
+    Args:
+        paper_id (str): ID of the paper
+        data (dict): The paper's PaperMainStructure row
+        bucket_name (str): Supabase storage bucket for figure images
+        force (bool): Rerun every stage even if its inputs have not changed
+        mode (str, optional): Figure extraction mode, "layout" or "grobid"
+
+    Returns:
+        dict: {"text": result of the text pipeline or None, "text_error": error message
+        or None, "figures": extracted figure/table records, "figures_failed": figures
+        that could not be added to the database, as returned by process_local_figures,
+        "figures_error": error message or None}
+    """
+    with document_lock(paper_id):
+        return _process_downloaded_paper(paper_id, download_paper(paper_id, data), bucket_name, force, mode)
+
+
+def _process_downloaded_paper(paper_id: str, local_file_path: str, bucket_name: str, force: bool,
+                              mode: str) -> dict:
+    manifest = StageManifest.for_paper(paper_id, force=force)
+    result = {"text": None, "text_error": None, "figures": [], "figures_failed": [], "figures_error": None}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="document-text") as executor:
+        text_future = executor.submit(process_local_text, paper_id, local_file_path, manifest)
+        try:
+            result["figures"], result["figures_failed"] = process_local_figures(
+                paper_id, local_file_path, manifest, bucket_name, mode
+            )
+        except Exception as e:
+            logger.error(f"Figure extraction failed for {paper_id}: {str(e)}")
+            result["figures_error"] = str(e)
+        try:
+            result["text"] = text_future.result()
+        except Exception as e:
+            logger.error(f"Text extraction failed for {paper_id}: {str(e)}")
+            result["text_error"] = str(e)
+    return result
@@ -1,40 +1,54 @@
-from typing import Union
-import uuid
-
-from fastapi import FastAPI
-
-from bs4 import BeautifulSoup
+from lxml import etree
+import io
 import json
 import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-import datetime  
-
-import fitz  # PyMuPDF
-# import cv2
-import numpy as np
-from PIL import Image
-from .utilities.uti import clean_text
+from concurrent.futures import ThreadPoolExecutor
 
-load_dotenv()
-
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from .utilities.uti import clean_text
+from .metrics import stage_timer, DIVISIONS_EXTRACTED
+from .supabase_client import get_supabase
 
+# TEI parsing engine: "bs4" builds a full BeautifulSoup tree, "iterparse" streams the
+# body with lxml and stops before the bibliography. Both produce identical output.
+TEI_PARSER_ENGINE = os.environ.get("TEI_PARSER_ENGINE", "bs4")
 
+# PaperContentGrobid writes: rows and JSON bytes per upsert request, and requests in flight
+DIVISIONS_CHUNK_SIZE = int(os.environ.get("DIVISIONS_CHUNK_SIZE", "100"))
+DIVISIONS_CHUNK_MAX_BYTES = int(os.environ.get("DIVISIONS_CHUNK_MAX_BYTES", str(1024 * 1024)))
+DIVISIONS_UPSERT_WORKERS = int(os.environ.get("DIVISIONS_UPSERT_WORKERS", "4"))
 
 
-def extract_divs_to_json(tei_file_path, paper_summary_id: str):
+def parse_tei_divisions(tei_content, engine: str = None):
     """
-    Extract divisions from TEI XML and store in Supabase
+    Parse the body divisions of a TEI XML document
     
     Args:
-        tei_file_path (str): Path to the TEI XML file
-        paper_summary_id (str): ID of the paper summary
+        tei_content (str | bytes): The TEI XML document
+        engine (str, optional): "bs4" or "iterparse". Defaults to TEI_PARSER_ENGINE.
+        
+    Returns:
+        list: One dict per top-level body division, with its heading and paragraphs
     """
-    with open(tei_file_path, 'r', encoding='utf-8') as tei:
-        soup = BeautifulSoup(tei, 'lxml-xml')
+    engine = engine or TEI_PARSER_ENGINE
+    if engine not in ("bs4", "iterparse"):
+        raise ValueError(f"Unknown TEI parser engine: {engine}")
+    
+    with stage_timer("tei_parse"):
+        if engine == "iterparse":
+            divisions = _parse_tei_divisions_iterparse(tei_content)
+        else:
+            divisions = _parse_tei_divisions_bs4(tei_content)
+    DIVISIONS_EXTRACTED.inc(len(divisions))
+    return divisions
+
+def _parse_tei_divisions_bs4(tei_content) -> list:
+    """
+    Parse the body divisions with a full BeautifulSoup tree.
+    """
+    # Imported here so starting the app does not pay for it
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(tei_content, 'lxml-xml')
     
     body_content = soup.body
     result = []
@@ -106,21 +120,223 @@ def extract_divs_to_json(tei_file_path, paper_summary_id: str):
                 
                 div_obj['para'].append(para_obj)
             
-            # Add paper and summary IDs
-            div_obj['paperSummaryID'] = paper_summary_id
             result.append(div_obj)
     
+    return result
+
+def _local_name(tag) -> str:
+    return etree.QName(tag).localname
+
+def _element_text(element) -> str:
+    # Same as BeautifulSoup's get_text(): all descendant text, excluding the element's tail
+    return ''.join(element.itertext())
+
+def _division_to_dict(div, order_index: int) -> dict:
+    """
+    Build the division dict for a TEI <div> element, exactly as the BeautifulSoup engine does.
+    """
+    div_obj = {'order_index': order_index}
+    
+    # Extract the heading (first <head> anywhere inside the division)
+    head = next(div.iter('{*}head'), None)
+    if head is not None:
+        div_obj['head'] = ' '.join(_element_text(head).split())
+        head_n = head.get('n')
+        if head_n:
+            div_obj['head_n'] = head_n.strip()
+    else:
+        div_obj['head'] = None
+    
+    div_obj['para'] = []
+    for para_index, p in enumerate(div.iter('{*}p')):
+        ref_markers = {}
+        for ref in p.iter('{*}ref'):
+            ref_markers[_element_text(ref)] = {
+                'id': ref.get('coords', ''),
+                'type': ref.get('type', '')
+            }
+        
+        div_obj['para'].append({
+            'text': ' '.join(_element_text(p).split()),
+            'refs': ref_markers,
+            'order_index': para_index
+        })
+    
+    return div_obj
+
+def _parse_tei_divisions_iterparse(tei_content) -> list:
+    """
+    Streaming equivalent of the BeautifulSoup engine built on lxml.etree.iterparse.
+    
+    Each top-level body division is converted and cleared as soon as it has been read,
+    so memory stays flat for long papers, and parsing stops at the end of <body>
+    without reading the bibliography in <back>.
+    """
+    if isinstance(tei_content, str):
+        tei_content = tei_content.encode('utf-8')
+    
+    result = []
+    depth = 0
+    body_depth = None
+    context = etree.iterparse(
+        io.BytesIO(tei_content),
+        events=('start', 'end'),
+        remove_comments=True,
+        remove_pis=True,
+        recover=True,
+        huge_tree=True
+    )
+    
+    for event, element in context:
+        if event == 'start':
+            depth += 1
+            if body_depth is None and _local_name(element.tag) == 'body':
+                body_depth = depth
+            continue
+        
+        if body_depth is None:
+            # Everything that ends before <body> starts (e.g. the header) can be dropped
+            element.clear()
+        elif depth == body_depth:
+            break
+        elif depth == body_depth + 1:
+            if _local_name(element.tag) == 'div':
+                result.append(_division_to_dict(element, len(result)))
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        depth -= 1
+    
+    return result
+
+def _parse_coords(coords: str) -> list:
+    """
+    Parse a GROBID coords attribute, "page,x,y,w,h;page,x,y,w,h;...", with 1-based
+    pages and positions in PDF points.
+    
+    Returns:
+        list: [page_index, x1, y1, x2, y2] boxes with zero-based page numbers
+    """
+    boxes = []
+    for part in (coords or "").split(";"):
+        values = part.split(",")
+        if len(values) != 5:
+            continue
+        try:
+            page, x, y, w, h = (float(v) for v in values)
+        except ValueError:
+            continue
+        boxes.append([int(page) - 1, x, y, x + w, y + h])
+    return boxes
+
+def parse_tei_figures(tei_content) -> list:
+    """
+    Parse the figures and tables GROBID found in the body of a TEI XML document.
+    Boxes are only present if GROBID was asked for figure coordinates (teiCoordinates).
+    
+    Args:
+        tei_content (str | bytes): The TEI XML document
+        
+    Returns:
+        list: One dict per figure/table with its type, TEI id, label, head, description
+        and boxes. Boxes are those of the figure's graphics when it has any, otherwise
+        those of the whole figure.
+    """
+    if isinstance(tei_content, str):
+        tei_content = tei_content.encode('utf-8')
+    root = etree.fromstring(tei_content)
+    body = next(root.iter('{*}body'), None)
+    if body is None:
+        return []
+    
+    result = []
+    for figure in body.iter('{*}figure'):
+        head = figure.find('{*}head')
+        label = figure.find('{*}label')
+        fig_desc = figure.find('{*}figDesc')
+        
+        graphic_boxes = []
+        for graphic in figure.iter('{*}graphic'):
+            graphic_boxes.extend(_parse_coords(graphic.get('coords')))
+        
+        result.append({
+            'figure_type': 'table' if figure.get('type') == 'table' else 'figure',
+            'xml_id': figure.get('{http://www.w3.org/XML/1998/namespace}id'),
+            'label': ' '.join(_element_text(label).split()) if label is not None else '',
+            'head': ' '.join(_element_text(head).split()) if head is not None else '',
+            'description': ' '.join(_element_text(fig_desc).split()) if fig_desc is not None else '',
+            'boxes': graphic_boxes or _parse_coords(figure.get('coords'))
+        })
+    return result
+
+def _chunk_rows(rows: list, max_rows: int, max_bytes: int) -> list:
+    """
+    Split rows into chunks of at most max_rows rows and roughly max_bytes of JSON.
+    A single row larger than max_bytes gets a chunk of its own.
+    """
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for row in rows:
+        row_bytes = len(json.dumps(row, default=str))
+        if chunk and (len(chunk) >= max_rows or chunk_bytes + row_bytes > max_bytes):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(row)
+        chunk_bytes += row_bytes
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def _upsert_division_chunk(chunk: list) -> list:
+    with stage_timer("divisions_insert"):
+        response = (
+            get_supabase().table("PaperContentGrobid")
+            .upsert(chunk, on_conflict="paperSummaryID,order_index")
+            .execute()
+        )
+    return response.data or []
+
+def insert_divisions(divisions: list, paper_summary_id: str,
+                     chunk_size: int = DIVISIONS_CHUNK_SIZE, max_chunk_bytes: int = DIVISIONS_CHUNK_MAX_BYTES,
+                     workers: int = DIVISIONS_UPSERT_WORKERS):
+    """
+    Store parsed divisions for a paper in Supabase
+    
+    Rows are upserted on (paperSummaryID, order_index), so processing a paper again
+    overwrites its divisions instead of duplicating them. Divisions left over from an
+    earlier run that produced more of them are deleted. Large papers are written in
+    size-bounded chunks, several at a time.
+    
+    Args:
+        divisions (list): Divisions as returned by parse_tei_divisions
+        paper_summary_id (str): ID of the paper summary
+        chunk_size (int): Maximum rows per upsert request
+        max_chunk_bytes (int): Maximum JSON payload per upsert request
+        workers (int): Upsert requests in flight at once
+    """
+    # Add paper and summary IDs
+    result = [dict(div_obj, paperSummaryID=paper_summary_id) for div_obj in divisions]
+    chunks = _chunk_rows(result, max(1, chunk_size), max_chunk_bytes)
+    
     try:
-        # Insert into Supabase
-        content_response = (
-            supabase.table("PaperContentGrobid")
-            .insert(result)
+        # Upsert into Supabase; map() keeps the rows in chunk order
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks) or 1))) as executor:
+            content_data = [row for rows in executor.map(_upsert_division_chunk, chunks) for row in rows]
+        
+        # Remove divisions from an earlier, longer version of the paper
+        (
+            get_supabase().table("PaperContentGrobid")
+            .delete()
+            .eq("paperSummaryID", paper_summary_id)
+            .gte("order_index", len(result))
             .execute()
         )
         return {
             "success": True,
-            "message": f"Successfully inserted {len(result)} divisions",
-            "data": content_response.data
+            "message": f"Successfully upserted {len(result)} divisions in {len(chunks)} chunks",
+            "data": content_data
         }
     except Exception as e:
         return {
@@ -128,5 +344,15 @@ def extract_divs_to_json(tei_file_path, paper_summary_id: str):
             "message": f"Failed to insert data: {str(e)}",
             "data": None
         }
-        
-        
\ No newline at end of file
+
+def extract_divs_to_json(tei_file_path, paper_summary_id: str):
+    """
+    Extract divisions from TEI XML and store in Supabase
+    
+    Args:
+        tei_file_path (str): Path to the TEI XML file
+        paper_summary_id (str): ID of the paper summary
+    """
+    with open(tei_file_path, 'r', encoding='utf-8') as tei:
+        divisions = parse_tei_divisions(tei.read())
+    return insert_divisions(divisions, paper_summary_id)
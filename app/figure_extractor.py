@@ -2,121 +2,560 @@ max_caption_distance = 200  # vertical proximity
 max_caption_height = 200      # to avoid full paragraphs
 max_heading_distance = 200
 max_heading_height = 200
+min_caption_overlap = 0.3    # horizontal overlap with the figure, keeps matches in the same column
 
-import pytesseract
-import layoutparser as lp
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from pdf2image import convert_from_path
 import os
 import io
+import time
 import uuid
 from pathlib import Path
 from PIL import Image as PILImage
 import logging
-import requests
 from typing import Union, Tuple
+from concurrent.futures import Future
+from .layout_service import (
+    layout_service, layout_blocks, LayoutBlock,
+    LAYOUT_MAX_BATCH_SIZE, LAYOUT_MODEL_CONFIG, LAYOUT_LABEL_MAP, LAYOUT_SCORE_THRESHOLD, LAYOUT_MODEL_VERSION
+)
+from .caption_matcher import CaptionIndex
+from .ocr import ocr_pool
+from .uploader import upload_pool
+from .metrics import stage_timer, PAGES_PROCESSED, PAGES_SKIPPED, FIGURES_EXTRACTED
+from .cache import result_cache, cache_key, file_sha256
+from .manifest import StageManifest, fingerprint, DOCUMENTS_DIR
+from .coalesce import document_lock
+from .stage_pipeline import Stage, run_pipeline
+from .pdf_render import (
+    open_pdf, close_pdf, page_sizes, page_may_have_figures, render_page, render_region, extract_region_text,
+    PAGE_RENDER_DPI, LAYOUT_DETECT_DPI, PAGES_IN_FLIGHT, PAGE_PREFILTER, PREFILTER_MIN_IMAGE_FRACTION, PREFILTER_MIN_DRAWINGS
+)
+from .extract import parse_tei_figures
+from .pipeline import fetch_tei
+
+from .supabase_client import get_supabase
+from .utilities.uti import download_file
+
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger('figure_extractor')
+
+# Everything detected layouts depend on besides the PDF itself
+LAYOUT_STAGE_CONFIG = {
+    "model_config": LAYOUT_MODEL_CONFIG,
+    "label_map": LAYOUT_LABEL_MAP,
+    "score_threshold": LAYOUT_SCORE_THRESHOLD,
+    "detect_dpi": LAYOUT_DETECT_DPI,
+    "render_dpi": PAGE_RENDER_DPI,
+    "prefilter": [PAGE_PREFILTER, PREFILTER_MIN_IMAGE_FRACTION, PREFILTER_MIN_DRAWINGS],
+}
+# Everything crops and captions depend on besides the layouts. Changing only these
+# reruns caption matching without detecting the pages again.
+CAPTION_STAGE_CONFIG = {
+    "render_dpi": PAGE_RENDER_DPI,
+    "max_caption_distance": max_caption_distance,
+    "max_caption_height": max_caption_height,
+    "max_heading_distance": max_heading_distance,
+    "max_heading_height": max_heading_height,
+    "min_caption_overlap": min_caption_overlap,
+}
+# "layout" runs the layout model on every page. "grobid" crops the figures and tables
+# GROBID located, with GROBID's captions, and only runs the layout model on pages where
+# GROBID found nothing or its boxes look wrong, or on every page if GROBID found nothing
+# usable. Text-only pages among them are still dropped by the pre-filter.
+FIGURE_EXTRACTION_MODE = os.environ.get("FIGURE_EXTRACTION_MODE", "layout")
+# GROBID figure boxes covering less or more of their page than this are not trusted
+GROBID_MIN_BOX_FRACTION = 0.01
+GROBID_MAX_BOX_FRACTION = 0.9
+# PaperFigures rows written per insert request, and retries of a failed request
+FIGURE_INSERT_CHUNK_SIZE = int(os.environ.get("FIGURE_INSERT_CHUNK_SIZE", "50"))
+FIGURE_INSERT_RETRIES = int(os.environ.get("FIGURE_INSERT_RETRIES", "2"))
+FIGURE_INSERT_BACKOFF_SECONDS = 0.5
+# Worker threads per stage of the page pipeline. Rendering and cropping spend most of
+# their time holding the PyMuPDF lock, so more threads would only queue on it. Detect
+# workers submit pages to the layout service together so it can batch them.
+PIPELINE_DETECT_WORKERS = int(os.environ.get("PIPELINE_DETECT_WORKERS", str(LAYOUT_MAX_BATCH_SIZE)))
+PIPELINE_CROP_WORKERS = int(os.environ.get("PIPELINE_CROP_WORKERS", "2"))
+PIPELINE_TEXT_WORKERS = int(os.environ.get("PIPELINE_TEXT_WORKERS", "4"))
+PIPELINE_UPLOAD_WORKERS = int(os.environ.get("PIPELINE_UPLOAD_WORKERS", "4"))
+# Figure record fields that do not depend on the paper id
+CACHED_FIGURE_FIELDS = ("figure_type", "figure_id", "head", "description", "page_number")
+
+def _encode_png(image: PILImage.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _upload_image(paper_summary_id: str, bucket_name: str, image_bytes: bytes) -> Tuple[str, Future]:
+    """
+    Queue a PNG crop for upload to Supabase storage under the paper's folder.
+    Blocks while the upload pool is full.
+    
+    Returns:
+        Tuple[str, Future]: (Storage path of the image, future resolving to its public URL)
+    """
+    storage_filename = f"{paper_summary_id}/{uuid.uuid4()}.png"
+    future = upload_pool.submit(get_supabase().storage.from_(bucket_name), storage_filename, image_bytes)
+    return storage_filename, future
+
+def _delete_figures(previous: dict):
+    """
+    Remove the PaperFigures rows and storage images written by an earlier run,
+    or by a run that failed part way.
+    
+    Args:
+        previous (dict): The figures_insert output recorded in the paper's manifest,
+            or the same shape for records of the current run. Records without an "id"
+            were uploaded but never inserted; only their image is removed.
+    """
+    records = previous.get("records", [])
+    try:
+        ids = [record["id"] for record in records if "id" in record]
+        if ids:
+            get_supabase().table("PaperFigures").delete().in_("id", ids).execute()
+        paths = [record["extracted_image_path"] for record in records]
+        if paths:
+            get_supabase().storage.from_(previous["bucket"]).remove(paths)
+        logger.info(f"Removed {len(records)} figures/tables")
+    except Exception as e:
+        logger.warning(f"Failed to remove figures: {str(e)}")
+
+def _resolve_upload(record: dict) -> bool:
+    """
+    Wait for a figure record's upload and replace its image_url future with the URL.
+    
+    Returns:
+        bool: Whether the upload succeeded
+    """
+    try:
+        record["image_url"] = record["image_url"].result()
+        return True
+    except Exception as e:
+        logger.error(f"Error uploading {record['figure_id']}: {str(e)}")
+        return False
+
+def _cache_figures(cache_entry: str, figures: list):
+    """
+    Store figure crops and metadata in the result cache so the same PDF
+    does not have to be rendered, detected and captioned again.
+    
+    Args:
+        cache_entry (str): Cache key
+        figures (list): (record, image_bytes) pairs
+    """
+    cached_figures = []
+    try:
+        for n, (record, image_bytes) in enumerate(figures):
+            crop_name = f"crop-{n}.png"
+            result_cache.put_bytes(cache_entry, crop_name, image_bytes)
+            cached_figures.append({
+                "crop": crop_name,
+                **{field: record[field] for field in CACHED_FIGURE_FIELDS}
+            })
+        result_cache.put_json(cache_entry, "figures.json", cached_figures)
+    except Exception as e:
+        logger.warning(f"Failed to cache figures: {str(e)}")
+
+def _load_cached_figures(cache_entry: str) -> Union[list, None]:
+    """
+    Load cached figure metadata and crops.
+    
+    Returns:
+        list: (metadata, image_bytes) pairs, or None on a cache miss
+    """
+    cached_figures = result_cache.get_json(cache_entry, "figures.json")
+    if cached_figures is None:
+        return None
+    
+    figures = []
+    for meta in cached_figures:
+        image_bytes = result_cache.get_bytes(cache_entry, meta["crop"])
+        if image_bytes is None:
+            return None
+        figures.append((meta, image_bytes))
+    return figures
+
+def _block_text(doc, i: int, block) -> Union[str, Future]:
+    """
+    Get the text of a layout block from the PDF text layer, falling back to
+    OCR only when the page has no text layer (scanned documents).
+    
+    Returns:
+        str or Future: The text, or a future from the OCR pool resolving to it
+    """
+    text = extract_region_text(doc, i, block.coordinates)
+    if text.strip():
+        return text
+    
+    logger.info(f"No text layer for block on page {i}, queueing OCR")
+    return ocr_pool.submit(render_region(doc, i, block.coordinates))
 
-# from app.utilities.uti import download_file
+def _resolve_text(record: dict):
+    """
+    Replace OCR futures in a figure record's heading and caption with their text.
+    """
+    for field in ("head", "description"):
+        value = record[field]
+        if isinstance(value, Future):
+            try:
+                value = value.result()
+            except Exception as e:
+                logger.error(f"OCR failed for {record['figure_id']}: {str(e)}")
+                value = ""
+        record[field] = value.strip()
 
+def _insert_figure_chunk(chunk: list, retries: int) -> Tuple[Union[list, None], Union[str, None]]:
+    """
+    Insert a chunk of records in one request, retrying with backoff on failure.
+    
+    Returns:
+        Tuple[list, str]: (The inserted rows, in the same order as chunk, or None if every
+        attempt failed; the error of the last failed attempt, or None)
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(FIGURE_INSERT_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        try:
+            with stage_timer("figures_insert"):
+                response = get_supabase().table("PaperFigures").insert(chunk).execute()
+        except Exception as e:
+            error = str(e)
+        else:
+            if response.data and len(response.data) == len(chunk):
+                return response.data, None
+            error = "no rows returned"
+        logger.warning(f"Insert of {len(chunk)} figure rows failed (attempt {attempt + 1}/{retries + 1}): {error}")
+    return None, error
 
-def download_file(url: str, destination_path: str, doc_dir: str = None) -> Tuple[bool, str]:
+def _insert_figures(records: list, chunk_size: int = FIGURE_INSERT_CHUNK_SIZE) -> Tuple[list, list]:
     """
-    Download a file from a URL to the specified destination path.
-    If the file already exists, it won't be downloaded again.
+    Insert figure/table records into the PaperFigures table in bulk.
+    
+    Records are written chunk_size at a time. A chunk that still fails after retries is
+    inserted row by row, so one bad row only loses itself and is reported individually.
     
     Args:
-        url (str): The URL of the file to download
-        destination_path (str): The local path where the file should be saved
-        doc_dir (str, optional): The document directory. If provided, it will be created.
+        records (list): Figure/table records
+        chunk_size (int): Maximum rows per insert request
         
     Returns:
-        Tuple[bool, str]: (Success status, Error message if any)
+        Tuple[list, list]: (Inserted records with their "id" set, errors as
+        {"figure_id", "error"} dicts for rows that could not be inserted)
     """
-    # Create document directory if provided
-    if doc_dir:
-        os.makedirs(doc_dir, exist_ok=True)
-        logger.info(f"Created/verified document directory: {doc_dir}")
+    inserted = []
+    errors = []
+    for start in range(0, len(records), max(1, chunk_size)):
+        chunk = records[start:start + chunk_size]
+        rows, _ = _insert_figure_chunk(chunk, FIGURE_INSERT_RETRIES)
+        
+        if rows is not None:
+            pairs = list(zip(chunk, rows))
+        else:
+            logger.warning(f"Falling back to row by row insert for {len(chunk)} figures")
+            pairs = []
+            for record in chunk:
+                row, error = _insert_figure_chunk([record], retries=0)
+                if row is None:
+                    logger.error(f"Failed to add {record['figure_type']} {record['figure_id']} to database: {error}")
+                    errors.append({"figure_id": record["figure_id"], "error": error})
+                else:
+                    pairs.append((record, row[0]))
+        
+        for record, row in pairs:
+            record["id"] = row["id"]
+            FIGURES_EXTRACTED.labels(record["figure_type"]).inc()
+            inserted.append(record)
+    
+    logger.info(f"Added {len(inserted)} figures/tables to database, {len(errors)} failed")
+    return inserted, errors
+
+def _process_page(doc, i: int, layout: list) -> list:
+    """
+    Crop and caption the figures and tables detected on one page.
     
-    # Check if file already exists
-    if os.path.exists(destination_path):
-        logger.info(f"File already exists at {destination_path}, skipping download")
-        return True, ""
+    Args:
+        doc: The open PyMuPDF document, used to render crops at full resolution
+        i (int): Zero-based page number
+        layout (list): LayoutBlocks detected on the page, in page space
+        
+    Returns:
+        list: (record, image_bytes) pairs holding the CACHED_FIGURE_FIELDS of each
+        figure/table. Heading and caption may still be pending OCR futures.
+    """
+    results = []
     
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    captions = CaptionIndex([b for b in layout if b.type == "Text"], min_overlap=min_caption_overlap)
     
-    try:
-        logger.info(f"Downloading file from {url}")
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+    for block_type, figure_type, prefix in (("Figure", "figure", "fig"), ("Table", "table", "table")):
+        for j, block in enumerate(b for b in layout if b.type == block_type):
+            try:
+                # Extract the figure/table
+                image_bytes = _encode_png(render_region(doc, i, block.coordinates))
+                
+                # Get heading text above and caption text below
+                heading = captions.nearest_above(block.coordinates, max_heading_distance, max_heading_height)
+                caption = captions.nearest_below(block.coordinates, max_caption_distance, max_caption_height)
+                
+                # Create entry in PaperFigures table
+                figure_data = {
+                    "figure_type": figure_type,
+                    "figure_id": f"{prefix}-{i}-{j}",
+                    "head": _block_text(doc, i, heading) if heading else "",
+                    "description": _block_text(doc, i, caption) if caption else "",
+                    "page_number": i + 1
+                }
+                
+                # Uploaded and inserted once any pending OCR for its heading and caption has finished
+                results.append((figure_data, image_bytes))
+                
+            except Exception as e:
+                logger.error(f"Error processing {figure_type} {j} on page {i}: {str(e)}")
+    
+    return results
+
+def _plan_grobid_pages(local_file_path: str, tei_figures: list) -> Union[list, None]:
+    """
+    Decide which pages can use the figure boxes from GROBID.
+    
+    A page is sent to the layout model instead when GROBID found no figure on it, or
+    when one of GROBID's boxes on it is implausibly small or large, or has neither
+    heading nor caption. GROBID misses figures, so a page without any is not trusted
+    to have none; the pre-filter keeps its text-only pages away from the model.
+    
+    Args:
+        local_file_path (str): Path of the source PDF
+        tei_figures (list): Figures as returned by parse_tei_figures
         
-        with open(destination_path, "wb") as f:
-            f.write(response.content)
-            
-        logger.info(f"File downloaded successfully to {destination_path}")
-        return True, ""
+    Returns:
+        list: Per page, the GROBID figures on it with their "box" in PDF points, or None
+        if the page needs the layout model. None instead of a list if GROBID found no
+        figures or could not locate one of them.
+    """
+    if not tei_figures:
+        logger.info("GROBID found no figures, detecting every page")
+        return None
+    
+    doc = open_pdf(local_file_path)
+    try:
+        sizes = page_sizes(doc)
+    finally:
+        close_pdf(doc)
+    
+    page_figures = [[] for _ in sizes]
+    uncertain_pages = set()
+    for figure in tei_figures:
+        page = figure["boxes"][0][0] if figure["boxes"] else None
+        if page is None or not 0 <= page < len(sizes):
+            logger.info(f"GROBID could not locate {figure['xml_id']}, detecting every page")
+            return None
         
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except requests.exceptions.ConnectionError as e:
-        error_msg = f"Connection error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except requests.exceptions.Timeout as e:
-        error_msg = f"Timeout error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except Exception as e:
-        error_msg = f"Error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
+        boxes = [box[1:] for box in figure["boxes"] if box[0] == page]
+        box = [
+            min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes)
+        ]
+        width, height = sizes[page]
+        fraction = (box[2] - box[0]) * (box[3] - box[1]) / (width * height)
+        if (
+            not GROBID_MIN_BOX_FRACTION <= fraction <= GROBID_MAX_BOX_FRACTION
+            or not (figure["head"] or figure["description"])
+        ):
+            uncertain_pages.add(page)
+        page_figures[page].append(dict(figure, box=box))
+    
+    for page in uncertain_pages:
+        page_figures[page] = None
+    page_figures = [figures or None for figures in page_figures]
+    grobid_pages = sum(1 for figures in page_figures if figures is not None)
+    logger.info(f"Using GROBID figures for {grobid_pages}/{len(sizes)} pages")
+    return page_figures
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger('figure_extractor')
+def _process_tei_figures(doc, i: int, figures: list) -> list:
+    """
+    Crop the figures and tables GROBID located on one page. Heading and caption
+    are taken from the TEI.
+    
+    Returns:
+        list: (record, image_bytes) pairs, as returned by _process_page
+    """
+    results = []
+    counts = {"figure": 0, "table": 0}
+    scale = PAGE_RENDER_DPI / 72.0
+    
+    for figure in figures:
+        figure_type = figure["figure_type"]
+        j = counts[figure_type]
+        counts[figure_type] += 1
+        try:
+            crop = render_region(doc, i, [c * scale for c in figure["box"]])
+            results.append(({
+                "figure_type": figure_type,
+                "figure_id": f"{'fig' if figure_type == 'figure' else 'table'}-{i}-{j}",
+                "head": figure["head"],
+                "description": figure["description"],
+                "page_number": i + 1
+            }, _encode_png(crop)))
+        except Exception as e:
+            logger.error(f"Error processing GROBID {figure_type} {figure['xml_id']} on page {i}: {str(e)}")
+    
+    return results
 
-load_dotenv()
+def _page_stages(doc, layouts: list, detect_pages: list, skipped: list, page_figures: list = None) -> list:
+    """
+    Build the pipeline stages that turn page numbers into figures:
+    render -> detect -> crop and caption -> caption text (OCR).
+    
+    Args:
+        doc: The open PyMuPDF document
+        layouts (list): One entry per page, filled in with the detected LayoutBlocks
+            as pages are detected. Pages that are not detected keep their entry.
+        detect_pages (list): Zero-based page numbers to run the layout model on.
+            Unless PAGE_PREFILTER is off, text-only pages among them get an empty layout.
+        skipped (list): Every page the pre-filter kept out of detection is appended to it
+        page_figures (list, optional): Per page GROBID figures, as planned by
+            _plan_grobid_pages. Pages with figures here are cropped from them.
+    
+    Returns:
+        list: Stages yielding ((page, n), (record, image_bytes)) items, as returned by _process_page
+    """
+    detect_pages = set(detect_pages)
+    
+    def render(i):
+        if i not in detect_pages:
+            yield i, None
+        elif PAGE_PREFILTER and not page_may_have_figures(doc, i):
+            PAGES_SKIPPED.inc()
+            skipped.append(i)
+            layouts[i] = []
+            yield i, None
+        else:
+            # Detect on cheap low resolution renders; crops are re-rendered at full resolution
+            yield i, render_page(doc, i, LAYOUT_DETECT_DPI)
+    
+    def detect(item):
+        i, image = item
+        if image is not None:
+            # Pages submitted by the detect workers at the same time are batched by the layout service
+            layout = layout_service.detect(image)
+            logger.info(f"Detected layout of page {i+1}/{len(layouts)}")
+            PAGES_PROCESSED.inc()
+            # Scale the detected boxes from detection pixels to page space
+            layouts[i] = layout_blocks(layout.scale(PAGE_RENDER_DPI / LAYOUT_DETECT_DPI))
+        yield i
+    
+    def crop(i):
+        logger.info(f"Processing page {i+1}/{len(layouts)}")
+        if page_figures is not None and page_figures[i] is not None:
+            figures = _process_tei_figures(doc, i, page_figures[i])
+        else:
+            figures = _process_page(doc, i, layouts[i])
+        for n, figure in enumerate(figures):
+            yield (i, n), figure
+    
+    def caption_text(item):
+        _resolve_text(item[1][0])
+        yield item
+    
+    return [
+        Stage("render", render),
+        Stage("detect", detect, PIPELINE_DETECT_WORKERS),
+        Stage("crop", crop, PIPELINE_CROP_WORKERS),
+        Stage("caption_text", caption_text, PIPELINE_TEXT_WORKERS),
+    ]
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+def _upload_stage(paper_summary_id: str, bucket_name: str, local_file_path: str,
+                  crops: list, uploaded: list) -> Stage:
+    """
+    Build the pipeline stage that uploads figure crops and turns them into PaperFigures records.
+    
+    Args:
+        crops (list): Every (key, (record, image_bytes)) item reaching the stage is appended to it
+        uploaded (list): Every record uploaded is appended to it
+    """
+    def upload(item):
+        crops.append(item)
+        key, (meta, image_bytes) = item
+        storage_path, image_url = _upload_image(paper_summary_id, bucket_name, image_bytes)
+        record = dict(meta)
+        record.update({
+            "paper_summary_id": paper_summary_id,
+            "extracted_image_path": storage_path,
+            "source_file": local_file_path,
+            "image_url": image_url
+        })
+        if _resolve_upload(record):
+            uploaded.append(record)
+            yield key, record
+    
+    return Stage("upload", upload, PIPELINE_UPLOAD_WORKERS)
 
-# Load the model
-model = lp.Detectron2LayoutModel(
-    config_path='lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config',
-    label_map={0: "Text", 1: "Title", 2: "List", 3: "Table", 4: "Figure"},
-    extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", 0.8]
-)
+def _insert_stream(items, chunk_size: int = FIGURE_INSERT_CHUNK_SIZE) -> Tuple[list, list]:
+    """
+    Insert uploaded records as they arrive, a full chunk at a time.
+    
+    Args:
+        items: (key, record) pairs from the upload stage
+        
+    Returns:
+        Tuple[list, list]: (Inserted records ordered by key, errors), as returned by _insert_figures
+    """
+    inserted = []
+    errors = []
+    pending = []
+    
+    def flush():
+        keys = {id(record): key for key, record in pending}
+        rows, chunk_errors = _insert_figures([record for _, record in pending], chunk_size)
+        inserted.extend((keys[id(record)], record) for record in rows)
+        errors.extend(chunk_errors)
+        pending.clear()
+    
+    for item in items:
+        pending.append(item)
+        if len(pending) >= chunk_size:
+            flush()
+    if pending:
+        flush()
+    
+    inserted.sort(key=lambda pair: pair[0])
+    return [record for _, record in inserted], errors
 
-def is_above(fig, txt):
-    return txt.coordinates[3] <= fig.coordinates[1]
+def _figures_entry(pdf_hash: str, layouts_hash: str, page_figures: list = None) -> Tuple[str, str]:
+    """
+    Returns:
+        Tuple[str, str]: (Input hash of the figures stage, its result cache key)
+    """
+    figures_input = layouts_hash if page_figures is None else fingerprint([layouts_hash, page_figures])
+    return figures_input, cache_key(pdf_hash, "figures", layouts=figures_input, **CAPTION_STAGE_CONFIG)
 
-def is_below(fig, txt):
-    return txt.coordinates[1] >= fig.coordinates[3]
+def _figures_hash(figures: list) -> str:
+    return fingerprint([dict(record, crop=fingerprint(image_bytes)) for record, image_bytes in figures])
 
-def extract_and_upload_figures(paper_summary_id: str, bucket_name: str = "figure-images"):
+def extract_and_upload_figures(paper_summary_id: str, bucket_name: str = "figure-images", force: bool = False,
+                               mode: str = None):
     """
     Extract figures and tables from a PDF, upload them to Supabase storage,
-    and add entries to the PaperFigures table.
+    and add entries to the PaperFigures table. The paper's document lock is held
+    from the download on.
     
     Args:
         paper_summary_id (str): UUID of the paper summary
         bucket_name (str): Supabase storage bucket name
+        force (bool): Rerun every stage even if its inputs have not changed
+        mode (str, optional): "layout" or "grobid". Defaults to FIGURE_EXTRACTION_MODE.
         
     Returns:
-        list: List of extracted figure/table data
+        list: List of extracted figure/table data. Figures that could not be added to
+        the database are left out and logged.
     """
     logger.info(f"Processing paper with ID: {paper_summary_id}")
     
     # Get document info from Supabase
-    response = supabase.table("PaperMainStructure").select("*").eq("id", str(paper_summary_id)).execute()
+    response = get_supabase().table("PaperMainStructure").select("*").eq("id", str(paper_summary_id)).execute()
     if not response.data:
         logger.error(f"Error: No data found for id: {paper_summary_id}")
         return []
@@ -129,202 +568,163 @@ def extract_and_upload_figures(paper_summary_id: str, bucket_name: str = "figure
         return []
     
     # Create directory based on document ID
-    doc_dir = f"./documents/{str(paper_summary_id)}"
+    doc_dir = os.path.join(DOCUMENTS_DIR, str(paper_summary_id))
     file_name = os.path.basename(pdf_url)
     local_file_path = os.path.join(doc_dir, file_name)
     
-    # Download the PDF file
-    download_success, error_message = download_file(pdf_url, local_file_path, doc_dir)
-    if not download_success:
-        logger.error(f"Failed to download PDF: {error_message}")
-        return []
+    with document_lock(paper_summary_id):
+        # Download the PDF file
+        download_success, error_message = download_file(pdf_url, local_file_path, doc_dir)
+        if not download_success:
+            logger.error(f"Failed to download PDF: {error_message}")
+            return []
+        
+        manifest = StageManifest.for_paper(paper_summary_id, force=force)
+        results, _ = process_local_figures(str(paper_summary_id), local_file_path, manifest, bucket_name, mode)
+        return results
+
+def process_local_figures(paper_summary_id: str, local_file_path: str, manifest: StageManifest,
+                          bucket_name: str = "figure-images", mode: str = None) -> Tuple[list, list]:
+    """
+    Extract, upload and insert the figures and tables of a paper whose PDF has already
+    been downloaded.
+    
+    Pages stream through render, layout detection, cropping and captioning, upload and
+    insert, so all of them work at the same time on different pages.
+    
+    Layout detection, caption matching and upload/insert are tracked in the paper's
+    stage manifest; each only runs when its inputs or settings have changed. When the
+    paper has been processed before, uploading waits until all figures are known, so a
+    rerun that produces the same figures uploads nothing.
+    
+    Args:
+        paper_summary_id (str): UUID of the paper summary
+        local_file_path (str): Path of the downloaded PDF
+        manifest (StageManifest): The paper's stage manifest. Its force flag reruns every stage.
+        bucket_name (str): Supabase storage bucket name
+        mode (str, optional): "layout" or "grobid". Defaults to FIGURE_EXTRACTION_MODE.
+        
+    Returns:
+        Tuple[list, list]: (List of extracted figure/table data, errors as
+        {"figure_id", "error"} dicts for figures that could not be added to the database)
+    """
+    mode = mode or FIGURE_EXTRACTION_MODE
+    if mode not in ("layout", "grobid"):
+        raise ValueError(f"Unknown figure extraction mode: {mode}")
+    
+    force = manifest.force
+    pdf_hash = file_sha256(local_file_path)
+    insert_config = {"table": "PaperFigures", "bucket": bucket_name}
     
-    # Create output directory for temporary storage
-    os.makedirs("output", exist_ok=True)
+    # In grobid mode the figures GROBID located are cropped directly, and only the
+    # remaining pages go through the layout model
+    page_figures = None
+    layout_config = LAYOUT_STAGE_CONFIG
+    if mode == "grobid":
+        try:
+            tei_content, _ = fetch_tei(local_file_path, manifest, pdf_hash)
+            page_figures = _plan_grobid_pages(local_file_path, parse_tei_figures(tei_content))
+        except Exception as e:
+            logger.warning(f"GROBID figures unavailable, detecting every page: {str(e)}")
+        if page_figures is not None:
+            layout_config = dict(LAYOUT_STAGE_CONFIG, pages=[i for i, figs in enumerate(page_figures) if figs is None])
     
-    # Convert PDF to images
+    # Nothing to do if no stage's inputs have changed since the last run
+    layout_output = manifest.lookup("layout", pdf_hash, LAYOUT_MODEL_VERSION, layout_config)
+    figures_input = layout_output and (
+        layout_output["sha256"] if page_figures is None else fingerprint([layout_output["sha256"], page_figures])
+    )
+    figures_output = figures_input and manifest.lookup("figures", figures_input, None, CAPTION_STAGE_CONFIG)
+    insert_output = figures_output and manifest.lookup("figures_insert", figures_output["sha256"], None, insert_config)
+    if insert_output:
+        logger.info(f"Figures of {paper_summary_id} unchanged since the last run")
+        return insert_output["records"], []
+    
+    # On a first run nothing can be unchanged, so upload and insert stream along with
+    # the other stages. On a rerun they wait for the figures hash, see below.
+    stream_upload = force or manifest.previous_output("figures_insert") is None
+    crops = []
+    uploaded = []
+    skipped = []
+    doc = open_pdf(local_file_path)
     try:
-        logger.info(f"Converting PDF to images: {local_file_path}")
-        pages = convert_from_path(local_file_path, dpi=300)
-        logger.info(f"Successfully converted {len(pages)} pages")
+        # Layouts are cached by PDF content, so the same PDF under another id is not
+        # detected again either
+        layout_entry = cache_key(pdf_hash, "layout", **layout_config)
+        layouts = None if force else result_cache.get_json(layout_entry, "layouts.json")
+        figures = None
+        if layouts is not None:
+            logger.info(f"Using cached layouts for PDF {pdf_hash}")
+            layouts = [None if page is None else [LayoutBlock(*block) for block in page] for page in layouts]
+            detect_pages = []
+            figures_input, figures_entry = _figures_entry(pdf_hash, fingerprint(layouts), page_figures)
+            figures = None if force else _load_cached_figures(figures_entry)
+        else:
+            layouts = [None] * doc.page_count
+            detect_pages = layout_config.get("pages", range(doc.page_count))
+        
+        if figures is not None:
+            logger.info(f"Using {len(figures)} cached figures/tables for PDF {pdf_hash}")
+            items, stages = enumerate(figures), []
+        else:
+            logger.info(f"Streaming {doc.page_count} pages from {local_file_path}")
+            items, stages = range(doc.page_count), _page_stages(doc, layouts, detect_pages, skipped, page_figures)
+        if stream_upload:
+            stages.append(_upload_stage(paper_summary_id, bucket_name, local_file_path, crops, uploaded))
+            results, errors = _insert_stream(run_pipeline(items, stages, PAGES_IN_FLIGHT))
+        elif stages:
+            crops = list(run_pipeline(items, stages, PAGES_IN_FLIGHT))
     except Exception as e:
-        logger.error(f"Error converting PDF to images: {str(e)}")
-        return []
+        logger.error(f"Error extracting figures: {str(e)}")
+        if uploaded:
+            # Roll back what this run wrote; the previous run's figures stay current
+            _delete_figures({"bucket": bucket_name, "records": uploaded})
+        return [], []
+    finally:
+        close_pdf(doc)
     
-    results = []
+    if detect_pages:
+        if PAGE_PREFILTER:
+            logger.info(f"Pre-filter skipped {len(skipped)}/{len(detect_pages)} text-only pages")
+        result_cache.put_json(layout_entry, "layouts.json", layouts)
+    layouts_hash = fingerprint(layouts)
+    manifest.record("layout", pdf_hash, LAYOUT_MODEL_VERSION, layout_config,
+                    {"cache_key": layout_entry, "name": "layouts.json", "sha256": layouts_hash})
     
-    for i, page in enumerate(pages):
-        logger.info(f"Processing page {i+1}/{len(pages)}")
-        layout = model.detect(page)
-        
-        figures = [b for b in layout if b.type == "Figure"]
-        text_blocks = [b for b in layout if b.type == "Text"]
-        table_blocks = [b for b in layout if b.type == "Table"]
-        
-        # Process figures
-        for j, fig in enumerate(figures):
-            try:
-                # Extract the figure
-                fig_img = page.crop(fig.coordinates)
-                temp_path = f"output/page{i}_figure{j}.png"
-                fig_img.save(temp_path)
-                
-                # Get heading text above
-                heading_candidates = [
-                    t for t in text_blocks
-                    if is_above(fig, t)
-                    and abs(fig.coordinates[1] - t.coordinates[3]) < max_heading_distance
-                    and (t.coordinates[3] - t.coordinates[1]) < max_heading_height
-                ]
-                heading_candidates.sort(key=lambda t: abs(fig.coordinates[1] - t.coordinates[3]))
-                
-                heading_text = ""
-                if heading_candidates:
-                    heading_crop = page.crop(heading_candidates[0].coordinates)
-                    heading_text = pytesseract.image_to_string(heading_crop)
-                
-                # Get caption text below
-                caption_candidates = [
-                    t for t in text_blocks
-                    if is_below(fig, t)
-                    and abs(t.coordinates[1] - fig.coordinates[3]) < max_caption_distance
-                    and (t.coordinates[3] - t.coordinates[1]) < max_caption_height
-                ]
-                caption_candidates.sort(key=lambda t: abs(t.coordinates[1] - fig.coordinates[3]))
-                
-                caption_text = ""
-                if caption_candidates:
-                    caption_crop = page.crop(caption_candidates[0].coordinates)
-                    caption_text = pytesseract.image_to_string(caption_crop)
-                
-                # Upload to Supabase
-                figure_id = str(uuid.uuid4())
-                storage_filename = f"{paper_summary_id}/{figure_id}.png"
-                
-                # Open the image and convert to bytes
-                with open(temp_path, "rb") as img_file:
-                    image_bytes = img_file.read()
-                
-                # Upload to Supabase storage
-                supabase.storage.from_(bucket_name).upload(
-                    path=storage_filename,
-                    file=image_bytes,
-                    file_options={"content-type": "image/png"}
-                )
-                
-                # Get the public URL
-                image_url = supabase.storage.from_(bucket_name).get_public_url(storage_filename)
-                
-                # Create entry in PaperFigures table
-                figure_data = {
-                    "paper_summary_id": paper_summary_id,
-                    "figure_type": "figure",
-                    "figure_id": f"fig-{i}-{j}",
-                    "head": heading_text.strip(),
-                    "description": caption_text.strip(),
-                    # "coords": str(fig.coordinates.tolist()),
-                    "extracted_image_path": temp_path,
-                    "page_number": i + 1,
-                    "source_file": local_file_path,
-                    "image_url": image_url
-                }
-                
-                # Insert into Supabase
-                response = supabase.table("PaperFigures").insert(figure_data).execute()
-                
-                if response.data:
-                    logger.info(f"Successfully added figure to database: {figure_id}")
-                    figure_data["id"] = response.data[0]["id"]
-                    results.append(figure_data)
-                else:
-                    logger.error("Failed to add figure to database")
-                
-            except Exception as e:
-                logger.error(f"Error processing figure {j} on page {i}: {str(e)}")
-        
-        # Process tables
-        for j, table in enumerate(table_blocks):
-            try:
-                # Extract the table
-                table_img = page.crop(table.coordinates)
-                temp_path = f"output/page{i}_table{j}.png"
-                table_img.save(temp_path)
-                
-                # Get heading text above (similar to figures)
-                heading_candidates = [
-                    t for t in text_blocks
-                    if is_above(table, t)
-                    and abs(table.coordinates[1] - t.coordinates[3]) < max_heading_distance
-                    and (t.coordinates[3] - t.coordinates[1]) < max_heading_height
-                ]
-                heading_candidates.sort(key=lambda t: abs(table.coordinates[1] - t.coordinates[3]))
-                
-                heading_text = ""
-                if heading_candidates:
-                    heading_crop = page.crop(heading_candidates[0].coordinates)
-                    heading_text = pytesseract.image_to_string(heading_crop)
-                
-                # Get caption text below
-                caption_candidates = [
-                    t for t in text_blocks
-                    if is_below(table, t)
-                    and abs(t.coordinates[1] - table.coordinates[3]) < max_caption_distance
-                    and (t.coordinates[3] - t.coordinates[1]) < max_caption_height
-                ]
-                caption_candidates.sort(key=lambda t: abs(t.coordinates[1] - table.coordinates[3]))
-                
-                caption_text = ""
-                if caption_candidates:
-                    caption_crop = page.crop(caption_candidates[0].coordinates)
-                    caption_text = pytesseract.image_to_string(caption_crop)
-                
-                # Upload to Supabase
-                table_id = str(uuid.uuid4())
-                storage_filename = f"{paper_summary_id}/{table_id}.png"
-                
-                # Open the image and convert to bytes
-                with open(temp_path, "rb") as img_file:
-                    image_bytes = img_file.read()
-                
-                # Upload to Supabase storage
-                supabase.storage.from_(bucket_name).upload(
-                    path=storage_filename,
-                    file=image_bytes,
-                    file_options={"content-type": "image/png"}
-                )
-                
-                # Get the public URL
-                image_url = supabase.storage.from_(bucket_name).get_public_url(storage_filename)
-                
-                # Create entry in PaperFigures table
-                table_data = {
-                    "paper_summary_id": paper_summary_id,
-                    "figure_type": "table",
-                    "figure_id": f"table-{i}-{j}",
-                    "head": heading_text.strip(),
-                    "description": caption_text.strip(),
-                    # "coords": str(table.coordinates.tolist()),
-                    "extracted_image_path": temp_path,
-                    "page_number": i + 1,
-                    "source_file": local_file_path,
-                    "image_url": image_url
-                }
-                
-                # Insert into Supabase
-                response = supabase.table("PaperFigures").insert(table_data).execute()
-                
-                if response.data:
-                    logger.info(f"Successfully added table to database: {table_id}")
-                    table_data["id"] = response.data[0]["id"]
-                    results.append(table_data)
-                else:
-                    logger.error("Failed to add table to database")
-                
-            except Exception as e:
-                logger.error(f"Error processing table {j} on page {i}: {str(e)}")
+    # Crops and captions, in page order
+    if figures is None:
+        figures = [figure for _, figure in sorted(crops, key=lambda item: item[0])]
+        figures_input, figures_entry = _figures_entry(pdf_hash, layouts_hash, page_figures)
+        _cache_figures(figures_entry, figures)
+    figures_hash = _figures_hash(figures)
+    manifest.record("figures", figures_input, None, CAPTION_STAGE_CONFIG,
+                    {"cache_key": figures_entry, "name": "figures.json", "sha256": figures_hash})
+    
+    if not stream_upload:
+        # Settings changes that do not change any figure need no new upload
+        insert_output = manifest.lookup("figures_insert", figures_hash, None, insert_config)
+        if insert_output:
+            logger.info(f"Figures of {paper_summary_id} unchanged since the last run")
+            return insert_output["records"], []
+        stage = _upload_stage(paper_summary_id, bucket_name, local_file_path, [], uploaded)
+        results, errors = _insert_stream(run_pipeline(enumerate(figures), [stage]))
+    
+    # Images whose rows could not be inserted are referenced nowhere, remove them now
+    orphaned = [record for record in uploaded if "id" not in record]
+    if orphaned:
+        _delete_figures({"bucket": bucket_name, "records": orphaned})
+    
+    # Replace what an earlier run of this paper wrote
+    complete = len(results) == len(figures) and not errors
+    previous = manifest.previous_output("figures_insert")
+    if previous:
+        _delete_figures(previous)
+    # An incomplete run is recorded so its rows are replaced next time, but never counts as current
+    manifest.record("figures_insert", figures_hash if complete else "", None, insert_config,
+                    {"bucket": bucket_name, "records": results})
     
     logger.info(f"Finished processing paper {paper_summary_id}. Extracted {len(results)} figures/tables")
-    return results
+    return results, errors
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+import threading
+
+import requests
+
+from .utilities.uti import get_http_session
+from .metrics import stage_timer
+
+logger = logging.getLogger('grobid_adapter')
+
+# Resolved against the repository rather than the working directory
+GROBID_CONFIG_PATH = os.environ.get(
+    "GROBID_CONFIG_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
+)
+
+# How long a failed version lookup is remembered before GROBID is asked again
+GROBID_VERSION_RETRY_SECONDS = float(os.environ.get("GROBID_VERSION_RETRY_SECONDS", "60"))
+
+
+class GrobidError(Exception):
+    """Raised when GROBID fails to process a document."""
+
+
+class GrobidAdapter:
+    """
+    Send single PDFs to a GROBID server and get the TEI back in memory.
+
+    Requests go over the shared pooled HTTP session, and at most `concurrency` requests
+    are in flight against the server at once. GROBID answers 503 when its own queue is
+    full; those requests are retried after `sleep_time` seconds.
+    """
+
+    def __init__(self, grobid_server: str, timeout: float = 60, concurrency: int = 1,
+                 sleep_time: float = 5, max_busy_retries: int = 10):
+        self.grobid_server = grobid_server.rstrip("/")
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.sleep_time = sleep_time
+        self.max_busy_retries = max_busy_retries
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._version = None
+        self._version_failed_at = None
+        self._version_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path: str = GROBID_CONFIG_PATH) -> "GrobidAdapter":
+        """
+        Build an adapter from a grobid-client style config.json. GROBID_CONCURRENCY
+        overrides the config's batch_size.
+        """
+        with open(config_path) as config_file:
+            config = json.load(config_file)
+        return cls(
+            grobid_server=config["grobid_server"],
+            timeout=config.get("timeout", 60),
+            concurrency=int(os.environ.get("GROBID_CONCURRENCY", config.get("batch_size", 1))),
+            sleep_time=config.get("sleep_time", 5)
+        )
+
+    def version(self) -> str:
+        """
+        Get the version of the GROBID server, used to key cached results.
+        The version is fetched once and remembered. A failed lookup is remembered as
+        "unknown" for GROBID_VERSION_RETRY_SECONDS, so while GROBID is down or slow each
+        paper does not wait for another lookup to time out.
+        """
+        with self._version_lock:
+            if self._version is not None:
+                return self._version
+            if (
+                self._version_failed_at is not None
+                and time.monotonic() - self._version_failed_at < GROBID_VERSION_RETRY_SECONDS
+            ):
+                return "unknown"
+            try:
+                response = get_http_session().get(f"{self.grobid_server}/api/version", timeout=10)
+                response.raise_for_status()
+                self._version = response.text.strip()
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Could not get GROBID version: {str(e)}")
+                self._version_failed_at = time.monotonic()
+                return "unknown"
+            return self._version
+
+    def process_fulltext(self, pdf_path: str, tei_coordinates: str = None) -> bytes:
+        """
+        Run processFulltextDocument on one PDF.
+
+        Args:
+            pdf_path (str): Path of the PDF to process
+            tei_coordinates (str, optional): Comma separated element names to return
+                coordinates for, e.g. "figure"
+
+        Returns:
+            bytes: The TEI XML document
+        """
+        with open(pdf_path, "rb") as pdf_file:
+            pdf_bytes = pdf_file.read()
+
+        data = {"consolidateHeader": "1"}
+        if tei_coordinates:
+            data["teiCoordinates"] = tei_coordinates
+        files = {"input": (os.path.basename(pdf_path), pdf_bytes, "application/pdf")}
+        url = f"{self.grobid_server}/api/processFulltextDocument"
+
+        for attempt in range(self.max_busy_retries + 1):
+            with self._semaphore:
+                logger.info(f"Sending {pdf_path} to GROBID")
+                try:
+                    with stage_timer("grobid"):
+                        response = get_http_session().post(url, files=files, data=data, timeout=self.timeout)
+                except requests.exceptions.RequestException as e:
+                    raise GrobidError(f"GROBID request failed: {str(e)}")
+
+            if response.status_code == 503:
+                logger.info(f"GROBID is busy, retrying in {self.sleep_time}s")
+                time.sleep(self.sleep_time)
+                continue
+            if response.status_code != 200:
+                raise GrobidError(f"GROBID returned {response.status_code}: {response.text[:200]}")
+            return response.content
+
+        raise GrobidError(f"GROBID still busy after {self.max_busy_retries} retries")
+
+
+_client = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_grobid_client() -> GrobidAdapter:
+    """
+    Get the GROBID adapter shared by the whole process.
+
+    The adapter is built from the config on first use rather than at import, so the
+    app can be imported from anywhere and starting it does not need the config, and it
+    is built again after a fork so worker processes do not share its request limit.
+    """
+    global _client, _pid
+    with _lock:
+        if _client is None or _pid != os.getpid():
+            _client = GrobidAdapter.from_config()
+            _pid = os.getpid()
+        return _client
+
+
+def set_grobid_client(client):
+    """
+    Replace the shared adapter, e.g. with an in-memory stand-in.
+    """
+    global _client, _pid
+    with _lock:
+        _client = client
+        _pid = os.getpid()
@@ -0,0 +1,128 @@
+import os
+import uuid
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger('job_queue')
+
+# Worker pool size. GROBID and Supabase calls are network bound, and layout detection
+# is batched across jobs by the shared layout service, so jobs run in threads.
+JOB_THREAD_WORKERS = int(os.environ.get("JOB_THREAD_WORKERS", "4"))
+# Maximum number of jobs waiting or running before new submissions are rejected
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "100"))
+# Number of finished jobs kept around so clients can still poll their results
+JOB_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", "1000"))
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class JobQueue:
+    """
+    Run document processing jobs in a bounded worker pool and keep track of their status.
+
+    The thread pool is created on first use so importing this module is cheap and safe
+    to do before forking.
+    """
+
+    def __init__(self, thread_workers: int = JOB_THREAD_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 max_finished: int = JOB_MAX_FINISHED):
+        self.thread_workers = thread_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread_pool = None
+
+    def _executor(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="job")
+        return self._thread_pool
+
+    def _pending_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job["future"].done())
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["future"].done()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def submit(self, job_type: str, fn: Callable, *args, **kwargs) -> str:
+        """
+        Submit a job for background execution.
+
+        Args:
+            job_type (str): Name of the job type, reported back to clients
+            fn (Callable): The function to run
+
+        Returns:
+            str: The job id
+        """
+        with self._lock:
+            if self._pending_count() >= self.max_pending:
+                raise JobQueueFull(f"Job queue is full ({self.max_pending} pending jobs)")
+
+            job_id = str(uuid.uuid4())
+            future = self._executor().submit(fn, *args, **kwargs)
+            self._jobs[job_id] = {
+                "id": job_id,
+                "type": job_type,
+                "future": future,
+                "created_at": _now(),
+                "finished_at": None,
+            }
+            self._prune()
+
+        def _on_done(f, job_id=job_id):
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job["finished_at"] = _now()
+            if f.exception() is not None:
+                logger.error(f"Job {job_id} failed: {f.exception()}")
+            else:
+                logger.info(f"Job {job_id} finished")
+
+        future.add_done_callback(_on_done)
+        logger.info(f"Submitted {job_type} job {job_id}")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Get the status of a job, including its result or error once finished.
+
+        Returns:
+            dict: Job status, or None if the job id is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+
+        future = job.pop("future")
+        if future.done():
+            error = future.exception()
+            if error is None:
+                job["status"] = "succeeded"
+                job["result"] = future.result()
+            else:
+                job["status"] = "failed"
+                job["error"] = getattr(error, "detail", None) or str(error)
+        elif future.running():
+            job["status"] = "running"
+        else:
+            job["status"] = "queued"
+        return job
+
+
+job_queue = JobQueue()
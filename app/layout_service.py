@@ -0,0 +1,201 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, NamedTuple, Optional
+
+from importlib import metadata
+
+from .metrics import stage_timer, LAYOUT_BATCH_SIZE
+
+logger = logging.getLogger('layout_service')
+
+
+def _package_version(name: str) -> str:
+    # Read from the installed metadata, without importing the package
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+LAYOUT_MODEL_CONFIG = 'lp://PubLayNet/faster_rcnn_R_50_FPN_3x/config'
+LAYOUT_LABEL_MAP = {0: "Text", 1: "Title", 2: "List", 3: "Table", 4: "Figure"}
+LAYOUT_SCORE_THRESHOLD = 0.8
+LAYOUT_MODEL_VERSION = f"layoutparser-{_package_version('layoutparser')}"
+
+# Micro-batching: pages are collected until the batch is full or the oldest page
+# has waited LAYOUT_MAX_WAIT_MS, whichever comes first.
+LAYOUT_MAX_BATCH_SIZE = int(os.environ.get("LAYOUT_MAX_BATCH_SIZE", "4"))
+LAYOUT_MAX_WAIT_MS = float(os.environ.get("LAYOUT_MAX_WAIT_MS", "50"))
+
+
+class LayoutBlock(NamedTuple):
+    """
+    A detected layout region, detached from layoutparser so it can be stored as JSON.
+    """
+    type: str
+    coordinates: tuple
+    score: Optional[float] = None
+
+
+def layout_blocks(layout) -> List[LayoutBlock]:
+    """
+    Convert a layoutparser layout into plain LayoutBlocks.
+    """
+    blocks = []
+    for block in layout:
+        score = getattr(block, "score", None)
+        blocks.append(LayoutBlock(
+            block.type,
+            tuple(float(c) for c in block.coordinates),
+            None if score is None else float(score)
+        ))
+    return blocks
+
+
+def load_layout_model():
+    """
+    Build the PubLayNet Detectron2 layout model.
+    """
+    # layoutparser pulls in torch and Detectron2, so it is only imported when the model is needed
+    import layoutparser as lp
+
+    return lp.Detectron2LayoutModel(
+        config_path=LAYOUT_MODEL_CONFIG,
+        label_map=LAYOUT_LABEL_MAP,
+        extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", LAYOUT_SCORE_THRESHOLD]
+    )
+
+
+def _detect_detectron2_batch(model, images: list) -> list:
+    """
+    Run a list of page images through a Detectron2 layout model in a single forward pass.
+    Mirrors what Detectron2LayoutModel.detect and DefaultPredictor do for one image.
+    """
+    import numpy as np
+    import torch
+    from PIL import Image as PILImage
+
+    predictor = model.model
+    inputs = []
+    for image in images:
+        if isinstance(image, PILImage.Image):
+            image = np.array(image.convert("RGB"))
+        if predictor.input_format == "RGB":
+            image = image[:, :, ::-1]
+        height, width = image.shape[:2]
+        transformed = predictor.aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(transformed.astype("float32").transpose(2, 0, 1))
+        inputs.append({"image": tensor, "height": height, "width": width})
+
+    with torch.no_grad():
+        outputs = predictor.model(inputs)
+    return [model.gather_output(output) for output in outputs]
+
+
+class LayoutInferenceService:
+    """
+    Owns the layout model and runs pages submitted from any thread through it in micro-batches.
+
+    The model is loaded once per process. The batching thread is started on first use and
+    restarted after a fork, so the model can be loaded before forking worker processes.
+    """
+
+    def __init__(self, model_factory: Callable = load_layout_model,
+                 max_batch_size: int = LAYOUT_MAX_BATCH_SIZE, max_wait_ms: float = LAYOUT_MAX_WAIT_MS):
+        self.model_factory = model_factory
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._model = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def load_model(self):
+        """
+        Load the layout model if it has not been loaded yet and return it.
+        """
+        with self._lock:
+            if self._model is None:
+                logger.info("Loading layout model")
+                self._model = self.model_factory()
+            return self._model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="layout-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, image) -> Future:
+        """
+        Queue a page image for layout detection.
+
+        Returns:
+            Future: Resolves to the detected layout
+        """
+        self.load_model()
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def detect(self, image):
+        """
+        Detect the layout of a single page image, blocking until it is done.
+        """
+        return self.submit(image).result()
+
+    def _run(self):
+        work_queue = self._queue
+        while True:
+            batch = [work_queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(work_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process_batch(batch)
+
+    def _process_batch(self, batch: list):
+        batch = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        LAYOUT_BATCH_SIZE.observe(len(batch))
+        try:
+            with stage_timer("detect"):
+                layouts = self._detect_batch([image for image, _ in batch])
+        except Exception as e:
+            logger.error(f"Layout detection failed for batch of {len(batch)} pages: {str(e)}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), layout in zip(batch, layouts):
+            future.set_result(layout)
+
+    def _detect_batch(self, images: List) -> list:
+        model = self._model
+        predictor = getattr(model, "model", None)
+        if len(images) > 1 and hasattr(predictor, "aug") and hasattr(model, "gather_output"):
+            return _detect_detectron2_batch(model, images)
+        return [model.detect(image) for image in images]
+
+
+layout_service = LayoutInferenceService()
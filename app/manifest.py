@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger('stage_manifest')
+
+DOCUMENTS_DIR = "./documents"
+MANIFEST_NAME = "manifest.json"
+
+
+def fingerprint(value) -> str:
+    """
+    SHA-256 of bytes, or of the canonical JSON form of any other value.
+    """
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+class StageManifest:
+    """
+    Per-paper record of what each processing stage last ran on.
+
+    A stage entry holds the hash of the stage's input, the version of the tool that ran
+    it, a hash of the settings it ran with and where its output was stored. A stage whose
+    input, version and settings all match its entry does not need to run again. Input
+    hashes are taken from the previous stage's output, so a change early in the pipeline
+    invalidates every stage after it.
+
+    The manifest is kept next to the paper's PDF in its document directory.
+    """
+
+    def __init__(self, path: str, force: bool = False):
+        self.path = path
+        self.force = force
+        self._lock = threading.Lock()
+        self._stages = self._load()
+        # Stages recorded through this instance, which are current even with force
+        self._recorded = set()
+
+    @classmethod
+    def for_paper(cls, paper_id: str, force: bool = False) -> "StageManifest":
+        """
+        Open the manifest of a paper.
+
+        Args:
+            paper_id (str): ID of the paper
+            force (bool): Treat every stage that ran before this manifest was opened as
+                stale; entries are still updated as stages run
+        """
+        return cls(os.path.join(DOCUMENTS_DIR, str(paper_id), MANIFEST_NAME), force=force)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as manifest_file:
+                return json.load(manifest_file).get("stages", {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {str(e)}")
+            return {}
+
+    def _save(self):
+        # Called with the lock held
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump({"stages": self._stages}, manifest_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, stage: str, input_hash: str, version: str, config: dict) -> Optional[dict]:
+        """
+        Get the recorded output of a stage if it last ran on the same input, tool version and settings.
+
+        Returns:
+            dict: The stage's output location, or None if the stage has to run
+        """
+        with self._lock:
+            if self.force and stage not in self._recorded:
+                return None
+            entry = self._stages.get(stage)
+        if (
+            entry is None
+            or entry["input_hash"] != input_hash
+            or entry["version"] != version
+            or entry["config_hash"] != fingerprint(config)
+        ):
+            return None
+        return entry["output"]
+
+    def previous_output(self, stage: str) -> Optional[dict]:
+        """
+        Get the recorded output of a stage whether or not it is still current.
+        """
+        with self._lock:
+            entry = self._stages.get(stage)
+        return None if entry is None else entry["output"]
+
+    def record(self, stage: str, input_hash: str, version: str, config: dict, output: dict):
+        """
+        Record that a stage ran and where its output is.
+
+        Args:
+            stage (str): Stage name
+            input_hash (str): Hash of the stage's input
+            version (str): Version of the tool that ran the stage, if any
+            config (dict): Settings the output depends on
+            output (dict): JSON-serializable output location, e.g. a result cache key
+        """
+        with self._lock:
+            self._stages[stage] = {
+                "input_hash": input_hash,
+                "version": version,
+                "config_hash": fingerprint(config),
+                "output": output,
+                "updated_at": time.time(),
+            }
+            self._recorded.add(stage)
+            self._save()
+
+    def stages(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._stages))
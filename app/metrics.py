@@ -0,0 +1,71 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# Buckets cover both sub-millisecond stages (caption text) and minute-long ones (GROBID)
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "paper_stage_seconds", "Time spent in each processing stage", ["stage"], buckets=_LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter("paper_stage_errors_total", "Processing stages that raised an exception", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "paper_request_seconds", "HTTP request latency", ["method", "route", "status"], buckets=_LATENCY_BUCKETS
+)
+PAGES_PROCESSED = Counter("paper_pages_processed_total", "PDF pages processed by the figure pipeline")
+PAGES_SKIPPED = Counter(
+    "paper_pages_skipped_total", "PDF pages the pre-filter kept out of layout detection"
+)
+FIGURES_EXTRACTED = Counter("paper_figures_extracted_total", "Figures and tables extracted", ["figure_type"])
+DIVISIONS_EXTRACTED = Counter("paper_divisions_extracted_total", "TEI body divisions extracted")
+LAYOUT_BATCH_SIZE = Histogram(
+    "paper_layout_batch_size", "Pages per layout model forward pass", buckets=(1, 2, 4, 8, 16, 32)
+)
+CACHE_LOOKUPS = Counter("paper_cache_lookups_total", "Result cache lookups", ["result"])
+REQUESTS_COALESCED = Counter(
+    "paper_requests_coalesced_total", "Calls that joined an identical call already in flight", ["operation"]
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Time a processing stage and count its failures.
+
+    Usage:
+        with stage_timer("grobid"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    When the app runs in several worker processes (PROMETHEUS_MULTIPROC_DIR is set),
+    the metrics of all workers are aggregated, whichever worker serves the scrape.
+
+    Returns:
+        Tuple[bytes, str]: (Body, content type)
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
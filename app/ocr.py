@@ -0,0 +1,78 @@
+import io
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image as PILImage
+
+from .metrics import observe_stage
+
+logger = logging.getLogger('ocr_pool')
+
+# Number of Tesseract worker processes
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Threads each Tesseract process may use. Tesseract's own OpenMP threading fights with
+# the pool for cores, so it is pinned to one thread per process by default.
+OCR_THREAD_LIMIT = os.environ.get("OCR_THREAD_LIMIT", "1")
+
+
+def _init_worker(thread_limit: str):
+    os.environ["OMP_THREAD_LIMIT"] = thread_limit
+
+
+def _ocr_png(png_bytes: bytes) -> str:
+    # Imported here so only the worker processes load Tesseract bindings
+    import pytesseract
+
+    return pytesseract.image_to_string(PILImage.open(io.BytesIO(png_bytes)))
+
+
+class OcrPool:
+    """
+    Bounded pool of Tesseract worker processes shared by all papers.
+
+    The pool is created on first use, and again after a fork, so it is never
+    inherited half-initialized by worker processes. Its processes are started by a
+    forkserver rather than forked from the threaded server process, which could
+    leave a child holding a lock some other thread had taken.
+    """
+
+    def __init__(self, workers: int = OCR_WORKERS, thread_limit: str = OCR_THREAD_LIMIT):
+        self.workers = max(1, workers)
+        self.thread_limit = thread_limit
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_init_worker,
+                    initargs=(self.thread_limit,)
+                )
+            return self._executor
+
+    def submit(self, image: PILImage.Image) -> Future:
+        """
+        Queue an image for OCR.
+
+        Returns:
+            Future: Resolves to the recognized text
+        """
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        future = self._get_executor().submit(_ocr_png, buffer.getvalue())
+        # Includes time spent waiting for a free worker
+        future.add_done_callback(lambda _: observe_stage("ocr", time.perf_counter() - start))
+        return future
+
+
+ocr_pool = OcrPool()
@@ -0,0 +1,154 @@
+import os
+import re
+import logging
+import threading
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image as PILImage
+
+from .metrics import stage_timer
+
+logger = logging.getLogger('pdf_render')
+
+# Resolution figure, table and caption crops are rendered at. Layout coordinates are
+# expressed in pixels at this resolution ("page space").
+PAGE_RENDER_DPI = int(os.environ.get("PAGE_RENDER_DPI", "300"))
+# Resolution pages are rasterized at for layout detection. PubLayNet boxes are as
+# accurate at this resolution and inference is several times cheaper.
+LAYOUT_DETECT_DPI = int(os.environ.get("LAYOUT_DETECT_DPI", "120"))
+# Number of pages waiting between two stages of the page pipeline; bounds the
+# rendered pages held in memory per paper
+PAGES_IN_FLIGHT = int(os.environ.get("PAGES_IN_FLIGHT", "4"))
+
+# Page pre-filter: only pages with an embedded image covering at least
+# PREFILTER_MIN_IMAGE_FRACTION of the page, at least PREFILTER_MIN_DRAWINGS vector paths,
+# or a text block that starts like a figure or table caption are sent to layout detection
+PAGE_PREFILTER = os.environ.get("PAGE_PREFILTER", "1") == "1"
+PREFILTER_MIN_IMAGE_FRACTION = float(os.environ.get("PREFILTER_MIN_IMAGE_FRACTION", "0.01"))
+PREFILTER_MIN_DRAWINGS = int(os.environ.get("PREFILTER_MIN_DRAWINGS", "8"))
+_CAPTION_START = re.compile(r"^\s*(fig(ure)?|table|tab)\.?\s*[0-9IVX]+", re.IGNORECASE)
+
+# PyMuPDF is not thread-safe, and several papers may be processed in threads at once,
+# so every call into it goes through this lock.
+fitz_lock = threading.RLock()
+
+
+def open_pdf(pdf_path: str):
+    """
+    Open a PDF document with PyMuPDF.
+    """
+    with fitz_lock:
+        return fitz.open(pdf_path)
+
+
+def close_pdf(doc):
+    with fitz_lock:
+        doc.close()
+
+
+def render_page(doc, page_index: int, dpi: int = PAGE_RENDER_DPI) -> PILImage.Image:
+    """
+    Rasterize a single page to an RGB PIL image.
+
+    Args:
+        doc: The open PyMuPDF document
+        page_index (int): Zero-based page number
+        dpi (int): Render resolution
+
+    Returns:
+        PIL.Image.Image: The rendered page
+    """
+    with fitz_lock, stage_timer("render"):
+        pix = doc[page_index].get_pixmap(dpi=dpi, alpha=False)
+        return PILImage.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def render_region(doc, page_index: int, coordinates, dpi: int = PAGE_RENDER_DPI) -> PILImage.Image:
+    """
+    Render only a region of a page, e.g. a detected figure or caption.
+
+    Args:
+        doc: The open PyMuPDF document
+        page_index (int): Zero-based page number
+        coordinates: (x1, y1, x2, y2) of the region in pixels at dpi
+        dpi (int): Resolution the coordinates are expressed in, and the crop is rendered at
+
+    Returns:
+        PIL.Image.Image: The rendered region
+    """
+    scale = 72.0 / dpi
+    x1, y1, x2, y2 = (float(c) * scale for c in coordinates)
+    with fitz_lock, stage_timer("crop"):
+        page = doc[page_index]
+        clip = fitz.Rect(x1, y1, x2, y2) & page.rect
+        pix = page.get_pixmap(dpi=dpi, clip=clip, alpha=False)
+        return PILImage.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def extract_region_text(doc, page_index: int, coordinates, dpi: int = PAGE_RENDER_DPI) -> str:
+    """
+    Read the text inside a region of a page from the PDF text layer.
+
+    Args:
+        doc: The open PyMuPDF document
+        page_index (int): Zero-based page number
+        coordinates: (x1, y1, x2, y2) of the region in pixels at dpi
+        dpi (int): Resolution the coordinates are expressed in
+
+    Returns:
+        str: The text in reading order, one line per text line. Empty for scanned pages.
+    """
+    scale = 72.0 / dpi
+    x1, y1, x2, y2 = (float(c) * scale for c in coordinates)
+    with fitz_lock, stage_timer("caption_text"):
+        words = doc[page_index].get_text("words", clip=fitz.Rect(x1, y1, x2, y2))
+
+    # Words are (x0, y0, x1, y1, text, block_no, line_no, word_no)
+    words.sort(key=lambda w: (w[5], w[6], w[7]))
+    lines = []
+    current_line = None
+    for word in words:
+        if (word[5], word[6]) != current_line:
+            lines.append([])
+            current_line = (word[5], word[6])
+        lines[-1].append(word[4])
+    return "\n".join(" ".join(line) for line in lines)
+
+
+def page_may_have_figures(doc, page_index: int) -> bool:
+    """
+    Cheaply decide from the PDF structure whether a page can contain a figure or table.
+    Pure prose pages have no sizeable images, few vector paths and no caption-like text.
+
+    Args:
+        doc: The open PyMuPDF document
+        page_index (int): Zero-based page number
+
+    Returns:
+        bool: Whether the page should go through layout detection
+    """
+    with fitz_lock, stage_timer("prefilter"):
+        page = doc[page_index]
+        page_area = abs(page.rect) or 1.0
+
+        for image in page.get_image_info():
+            if abs(fitz.Rect(image["bbox"]) & page.rect) / page_area >= PREFILTER_MIN_IMAGE_FRACTION:
+                return True
+
+        if len(page.get_cdrawings()) >= PREFILTER_MIN_DRAWINGS:
+            return True
+
+        # Blocks are (x0, y0, x1, y1, text, block_no, block_type); type 0 is text
+        for block in page.get_text("blocks"):
+            if block[6] == 0 and _CAPTION_START.match(block[4]):
+                return True
+    return False
+
+
+def page_sizes(doc) -> List[Tuple[float, float]]:
+    """
+    Get the (width, height) of every page in PDF points.
+    """
+    with fitz_lock:
+        return [(page.rect.width, page.rect.height) for page in doc]
@@ -0,0 +1,228 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Tuple
+
+from .extract import parse_tei_divisions, insert_divisions, TEI_PARSER_ENGINE
+from .grobid import get_grobid_client
+from .cache import result_cache, cache_key, file_sha256
+from .manifest import StageManifest, fingerprint, DOCUMENTS_DIR
+from .coalesce import document_lock
+from .supabase_client import get_supabase
+from .utilities.uti import download_file
+
+logger = logging.getLogger('grobid_pipeline')
+
+# Maximum number of papers in each stage at once, shared by single and batch requests
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "8"))
+EXTRACT_CONCURRENCY = int(os.environ.get("EXTRACT_CONCURRENCY", "4"))
+INSERT_CONCURRENCY = int(os.environ.get("INSERT_CONCURRENCY", "4"))
+# PostgREST puts `in` filters in the query string, so ids are looked up in chunks
+ID_QUERY_CHUNK_SIZE = 100
+# Elements GROBID returns coordinates for. Figure boxes let the figure pipeline crop
+# figures straight from the TEI without running the layout model.
+GROBID_TEI_COORDINATES = "figure"
+
+_download_slots = threading.BoundedSemaphore(DOWNLOAD_CONCURRENCY)
+_extract_slots = threading.BoundedSemaphore(EXTRACT_CONCURRENCY)
+_insert_slots = threading.BoundedSemaphore(INSERT_CONCURRENCY)
+# One lock per TEI being fetched, with the number of threads using it
+_tei_fetches = {}
+_tei_fetches_lock = threading.Lock()
+
+
+class PipelineError(Exception):
+    """Raised when a stage of the document pipeline fails."""
+
+
+def fetch_paper_rows(ids: list) -> dict:
+    """
+    Fetch PaperMainStructure rows for many papers with `in` queries.
+
+    Args:
+        ids (list): Paper ids as strings
+
+    Returns:
+        dict: Rows keyed by paper id. Unknown ids are missing.
+    """
+    rows = {}
+    for start in range(0, len(ids), ID_QUERY_CHUNK_SIZE):
+        chunk = ids[start:start + ID_QUERY_CHUNK_SIZE]
+        response = get_supabase().table("PaperMainStructure").select("*").in_("id", chunk).execute()
+        for row in response.data:
+            rows[str(row["id"])] = row
+    return rows
+
+
+def download_paper(paper_id: str, data: dict) -> str:
+    """
+    Download a paper's PDF into its document directory.
+
+    Returns:
+        str: Path of the local PDF
+    """
+    pdf_file_path = data.get("pdf_file_path")
+    if not pdf_file_path:
+        raise PipelineError("PDF file path not found in the record")
+
+    # Create directory based on document ID
+    doc_dir = os.path.join(DOCUMENTS_DIR, paper_id)
+    local_file_path = os.path.join(doc_dir, os.path.basename(pdf_file_path))
+
+    with _download_slots:
+        download_success, error_message = download_file(pdf_file_path, local_file_path, doc_dir)
+    if not download_success:
+        raise PipelineError(f"Failed to download PDF: {error_message}")
+    return local_file_path
+
+
+@contextmanager
+def _tei_fetch_lock(cache_entry: str):
+    # Threads fetching the same TEI, e.g. the text and figure pipelines of one paper,
+    # take turns so only the first one calls GROBID
+    with _tei_fetches_lock:
+        lock, users = _tei_fetches.get(cache_entry, (threading.Lock(), 0))
+        _tei_fetches[cache_entry] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _tei_fetches_lock:
+            lock, users = _tei_fetches[cache_entry]
+            if users == 1:
+                del _tei_fetches[cache_entry]
+            else:
+                _tei_fetches[cache_entry] = (lock, users - 1)
+
+
+def fetch_tei(local_file_path: str, manifest: StageManifest, pdf_hash: str = None) -> Tuple[bytes, dict]:
+    """
+    Get the TEI of a PDF from the result cache or by running GROBID, and record the
+    grobid stage in the paper's manifest. Concurrent calls for the same PDF run GROBID once.
+
+    Returns:
+        Tuple[bytes, dict]: (The TEI XML document, the grobid stage output with its
+        cache_key, name and sha256)
+    """
+    pdf_hash = pdf_hash or file_sha256(local_file_path)
+    grobid_version = get_grobid_client().version()
+
+    # Results are cached by PDF content, so the same paper uploaded under another id
+    # or processed again is served without calling GROBID
+    cache_entry = cache_key(
+        pdf_hash,
+        "grobid",
+        grobid_server=get_grobid_client().grobid_server,
+        grobid_version=grobid_version,
+        tei_coordinates=GROBID_TEI_COORDINATES
+    )
+    with _tei_fetch_lock(cache_entry):
+        # With force the cache is only used if GROBID already ran during this run
+        fresh = manifest.lookup("grobid", pdf_hash, grobid_version, _grobid_config())
+        tei_content = None if manifest.force and fresh is None else result_cache.get_bytes(cache_entry, "tei.xml")
+        if tei_content is None:
+            # Concurrency against GROBID is limited by the adapter itself
+            tei_content = get_grobid_client().process_fulltext(local_file_path, tei_coordinates=GROBID_TEI_COORDINATES)
+            result_cache.put_bytes(cache_entry, "tei.xml", tei_content)
+        else:
+            logger.info(f"Using cached TEI for PDF {pdf_hash}")
+
+        tei_output = {"cache_key": cache_entry, "name": "tei.xml", "sha256": fingerprint(tei_content)}
+        manifest.record("grobid", pdf_hash, grobid_version, _grobid_config(), tei_output)
+    return tei_content, tei_output
+
+
+def _grobid_config() -> dict:
+    return {"grobid_server": get_grobid_client().grobid_server, "tei_coordinates": GROBID_TEI_COORDINATES}
+
+
+def extract_divisions(local_file_path: str, manifest: StageManifest) -> list:
+    """
+    Get the body divisions of a PDF, from the result cache or by running GROBID.
+    GROBID and TEI parsing are skipped when the paper's manifest shows their inputs
+    have not changed since the last run.
+    """
+    pdf_hash = file_sha256(local_file_path)
+
+    tei_output = manifest.lookup("grobid", pdf_hash, get_grobid_client().version(), _grobid_config())
+    if tei_output is not None:
+        parse_output = manifest.lookup("tei_parse", tei_output["sha256"], TEI_PARSER_ENGINE, {})
+        if parse_output is not None:
+            divisions = result_cache.get_json(parse_output["cache_key"], parse_output["name"])
+            if divisions is not None:
+                logger.info(f"TEI for PDF {pdf_hash} unchanged, skipping GROBID and parsing")
+                return divisions
+
+    tei_content, tei_output = fetch_tei(local_file_path, manifest, pdf_hash)
+    cache_entry = tei_output["cache_key"]
+
+    divisions = None if manifest.force else result_cache.get_json(cache_entry, "divisions.json")
+    if divisions is not None:
+        logger.info(f"Using cached divisions for PDF {pdf_hash}")
+    else:
+        # Process the TEI output
+        with _extract_slots:
+            divisions = parse_tei_divisions(tei_content)
+        result_cache.put_json(cache_entry, "divisions.json", divisions)
+    manifest.record("tei_parse", tei_output["sha256"], TEI_PARSER_ENGINE, {},
+                    {"cache_key": cache_entry, "name": "divisions.json"})
+    return divisions
+
+
+def process_paper_text(paper_id: str, data: dict, force: bool = False) -> dict:
+    """
+    Run download -> GROBID -> TEI extraction -> insert for one paper, holding the
+    paper's document lock.
+
+    Args:
+        paper_id (str): ID of the paper
+        data (dict): The paper's PaperMainStructure row
+        force (bool): Rerun every stage even if its inputs have not changed
+
+    Returns:
+        dict: The processing result
+    """
+    with document_lock(paper_id):
+        local_file_path = download_paper(paper_id, data)
+        result = process_local_text(paper_id, local_file_path, StageManifest.for_paper(paper_id, force=force))
+    result["data"] = data
+    return result
+
+
+def process_local_text(paper_id: str, local_file_path: str, manifest: StageManifest) -> dict:
+    """
+    Run GROBID -> TEI extraction -> insert for a paper whose PDF has already been downloaded.
+
+    Args:
+        paper_id (str): ID of the paper
+        local_file_path (str): Path of the downloaded PDF
+        manifest (StageManifest): The paper's stage manifest
+
+    Returns:
+        dict: The processing result, without the paper's row
+    """
+    divisions = extract_divisions(local_file_path, manifest)
+
+    divisions_hash = fingerprint(divisions)
+    insert_config = {"table": "PaperContentGrobid"}
+    if manifest.lookup("divisions_insert", divisions_hash, None, insert_config) is not None:
+        logger.info(f"Divisions of {paper_id} unchanged, skipping insert")
+        extract_result = {
+            "success": True,
+            "message": f"{len(divisions)} divisions unchanged since the last run",
+            "data": None
+        }
+    else:
+        with _insert_slots:
+            extract_result = insert_divisions(divisions, paper_id)
+        if not extract_result['success']:
+            raise PipelineError(f"Failed to process TEI: {extract_result['message']}")
+        manifest.record("divisions_insert", divisions_hash, None, insert_config, {"rows": len(divisions)})
+
+    return {
+        "message": "PDF processed and data extracted successfully",
+        "local_file_path": local_file_path,
+        "extraction_result": extract_result,
+        "division_count": len(divisions)
+    }
@@ -0,0 +1,77 @@
+import os
+import time
+import logging
+import threading
+
+from .layout_service import layout_service
+from .supabase_client import get_supabase
+
+logger = logging.getLogger('readiness')
+
+# Load the layout model in the background as soon as the app starts, instead of on
+# the first /images request. The app reports not ready until this has finished.
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "0") == "1"
+
+
+class WarmUp:
+    """
+    Loads the heavyweight resources ahead of the first request: the Supabase client,
+    the figure pipeline's imports (PyMuPDF, PIL), the layout model and its first
+    forward pass, which is much slower than later ones.
+    """
+
+    def __init__(self):
+        self.state = "idle"
+        self.error = None
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """
+        Start warming up in a background thread.
+
+        Returns:
+            bool: False if a warm-up is already running or has finished
+        """
+        with self._lock:
+            if self.state in ("running", "done"):
+                return False
+            self.state = "running"
+            self.error = None
+        threading.Thread(target=self._run, name="warm-up", daemon=True).start()
+        return True
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            get_supabase()
+            from PIL import Image as PILImage
+            from . import figure_extractor  # noqa: F401
+            layout_service.detect(PILImage.new("RGB", (850, 1100), "white"))
+        except Exception as e:
+            logger.error(f"Warm-up failed: {str(e)}")
+            with self._lock:
+                self.state = "failed"
+                self.error = str(e)
+            return
+        self.seconds = time.perf_counter() - start
+        logger.info(f"Warm-up finished in {self.seconds:.1f}s")
+        with self._lock:
+            self.state = "done"
+
+    def status(self) -> dict:
+        """
+        Readiness report. Without a warm-up the app is ready at once and loads
+        resources on first use.
+        """
+        with self._lock:
+            return {
+                "ready": self.state in ("idle", "done"),
+                "warm_up": self.state,
+                "warm_up_seconds": self.seconds,
+                "model_loaded": layout_service.model_loaded,
+                "error": self.error,
+            }
+
+
+warm_up = WarmUp()
@@ -0,0 +1,138 @@
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, Iterator, List, NamedTuple
+
+logger = logging.getLogger('stage_pipeline')
+
+# Default number of items waiting between two stages
+STAGE_QUEUE_SIZE = 4
+# How often blocked stages check whether the pipeline has been aborted
+_POLL_SECONDS = 0.1
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    """
+    One stage of a pipeline. fn takes an item and returns an iterable of items for the
+    next stage: empty to drop the item, several to fan it out.
+    """
+    name: str
+    fn: Callable[[object], Iterable]
+    workers: int = 1
+
+
+class _Run:
+    def __init__(self):
+        self.stopped = threading.Event()
+        self.error = None
+        self._lock = threading.Lock()
+
+    def fail(self, stage: str, error: Exception):
+        with self._lock:
+            if self.error is None:
+                logger.error(f"Stage {stage} failed: {str(error)}")
+                self.error = error
+        self.stopped.set()
+
+    def put(self, work_queue: queue.Queue, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                work_queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, work_queue: queue.Queue):
+        while not self.stopped.is_set():
+            try:
+                return work_queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _DONE
+
+
+def _feed(run: _Run, items: Iterable, out_queue: queue.Queue):
+    try:
+        for item in items:
+            if not run.put(out_queue, item):
+                return
+    except Exception as e:
+        run.fail("input", e)
+        return
+    run.put(out_queue, _DONE)
+
+
+def _work(run: _Run, stage: Stage, in_queue: queue.Queue, out_queue: queue.Queue, remaining: List[int]):
+    while True:
+        item = run.get(in_queue)
+        if item is _DONE:
+            # Let the other workers of this stage see the end of the input too
+            run.put(in_queue, _DONE)
+            break
+        try:
+            for result in stage.fn(item):
+                if not run.put(out_queue, result):
+                    return
+        except Exception as e:
+            run.fail(stage.name, e)
+            return
+
+    # The last worker of a stage to finish passes the end of the input on
+    with run._lock:
+        remaining[0] -= 1
+        last = remaining[0] == 0
+    if last:
+        run.put(out_queue, _DONE)
+
+
+def run_pipeline(items: Iterable, stages: List[Stage], queue_size: int = STAGE_QUEUE_SIZE) -> Iterator:
+    """
+    Stream items through a chain of stages, each running in its own worker threads.
+
+    Stages are connected by queues holding at most queue_size items, so a slow stage
+    holds back the ones before it instead of letting work pile up in memory, and every
+    stage works on a different item at the same time. A paper then takes about as long
+    as its slowest stage rather than the sum of all of them.
+
+    Args:
+        items (Iterable): Input of the first stage. Consumed in a background thread.
+        stages (List[Stage]): The stages, in order
+        queue_size (int): Maximum number of items waiting between two stages
+
+    Yields:
+        Outputs of the last stage, in the order they are finished
+
+    Raises:
+        Exception: The first exception raised by a stage or by iterating items. The
+        remaining work is abandoned, but items already being processed are finished
+        first, so the caller can safely release what the stages use.
+    """
+    run = _Run()
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=_feed, args=(run, items, queues[0]), name="pipeline-input", daemon=True)]
+    for n, stage in enumerate(stages):
+        workers = max(1, stage.workers)
+        remaining = [workers]
+        for w in range(workers):
+            threads.append(threading.Thread(
+                target=_work, args=(run, stage, queues[n], queues[n + 1], remaining),
+                name=f"pipeline-{stage.name}-{w}", daemon=True
+            ))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = run.get(queues[-1])
+            if item is _DONE:
+                break
+            yield item
+        if run.error is not None:
+            raise run.error
+    finally:
+        # Also stops the workers when the caller gives up early
+        run.stopped.set()
+        for thread in threads:
+            thread.join()
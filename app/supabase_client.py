@@ -0,0 +1,38 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_client = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_supabase():
+    """
+    Get the Supabase client shared by the whole process.
+
+    The client is created on first use rather than at import, so starting the app does
+    not pay for it, and it is created again after a fork so worker processes do not
+    share connections.
+    """
+    global _client, _pid
+    with _lock:
+        if _client is None or _pid != os.getpid():
+            from supabase import create_client
+
+            _client = create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY"))
+            _pid = os.getpid()
+        return _client
+
+
+def set_supabase(client):
+    """
+    Replace the shared client, e.g. with an in-memory stand-in.
+    """
+    global _client, _pid
+    with _lock:
+        _client = client
+        _pid = os.getpid()
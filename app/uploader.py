@@ -0,0 +1,89 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .metrics import stage_timer
+
+logger = logging.getLogger('storage_uploader')
+
+# Uploads in flight at once, and uploads that may be queued behind them before
+# submit() blocks the caller
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "8"))
+UPLOAD_MAX_PENDING = int(os.environ.get("UPLOAD_MAX_PENDING", "32"))
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", "3"))
+UPLOAD_BACKOFF_SECONDS = float(os.environ.get("UPLOAD_BACKOFF_SECONDS", "0.5"))
+
+
+class StorageUploader:
+    """
+    Bounded thread pool that uploads in-memory files to Supabase storage.
+
+    submit() blocks once max_pending uploads are queued or running, so a fast producer
+    (page rendering) cannot pile up an unbounded amount of image bytes in memory.
+    The pool is created on first use, and again after a fork.
+    """
+
+    def __init__(self, workers: int = UPLOAD_WORKERS, max_pending: int = UPLOAD_MAX_PENDING,
+                 retries: int = UPLOAD_RETRIES, backoff_seconds: float = UPLOAD_BACKOFF_SECONDS):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="uploader")
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+            return self._executor, self._slots
+
+    def _upload(self, bucket, path: str, data: bytes, content_type: str) -> str:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+            try:
+                with stage_timer("upload"):
+                    # upsert so a retry after a request that did land does not fail as a duplicate
+                    bucket.upload(
+                        path=path,
+                        file=data,
+                        file_options={"content-type": content_type, "upsert": "true"}
+                    )
+                return bucket.get_public_url(path)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Upload of {path} failed (attempt {attempt + 1}/{self.retries + 1}): {str(e)}")
+
+    def submit(self, bucket, path: str, data: bytes, content_type: str = "image/png") -> Future:
+        """
+        Queue a file for upload, blocking while the queue is full.
+
+        Args:
+            bucket: Supabase storage bucket, i.e. supabase.storage.from_(bucket_name)
+            path (str): Path of the file inside the bucket
+            data (bytes): File content
+            content_type (str): MIME type of the file
+
+        Returns:
+            Future: Resolves to the public URL of the uploaded file
+        """
+        executor, slots = self._get_executor()
+        slots.acquire()
+        try:
+            future = executor.submit(self._upload, bucket, path, data, content_type)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+
+upload_pool = StorageUploader()
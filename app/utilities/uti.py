@@ -1,7 +1,11 @@
 import os
+import time
 import logging
+import threading
 import requests
+import requests.adapters
 from typing import Union, Tuple
+from ..metrics import stage_timer
 
 
 logging.basicConfig(
@@ -35,15 +39,88 @@ def clean_text(text):
     
     return cleaned.strip()
 
-def download_file(url: str, destination_path: str, doc_dir: str = None) -> Tuple[bool, str]:
+# Download settings
+DOWNLOAD_CONNECT_TIMEOUT = float(os.environ.get("DOWNLOAD_CONNECT_TIMEOUT", "10"))
+DOWNLOAD_READ_TIMEOUT = float(os.environ.get("DOWNLOAD_READ_TIMEOUT", "60"))
+DOWNLOAD_MAX_BYTES = int(os.environ.get("DOWNLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+DOWNLOAD_MAX_RETRIES = int(os.environ.get("DOWNLOAD_MAX_RETRIES", "4"))
+DOWNLOAD_BACKOFF_SECONDS = float(os.environ.get("DOWNLOAD_BACKOFF_SECONDS", "1"))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "16"))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a download exceeds DOWNLOAD_MAX_BYTES."""
+
+
+def get_http_session() -> requests.Session:
+    """
+    Get the process-wide HTTP session, so connections are pooled and kept alive
+    across downloads instead of being opened for every request. The session is
+    created again after a fork so worker processes do not share pooled sockets.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            _session_pid = os.getpid()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _download_to(url: str, part_path: str, max_bytes: int):
+    """
+    Stream a URL into part_path, resuming from whatever part_path already holds.
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    
+    with get_http_session().get(url, stream=True, headers=headers,
+                                timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as response:
+        if offset and response.status_code == 416:
+            # The partial file is not a prefix the server recognizes; start over
+            os.remove(part_path)
+            return _download_to(url, part_path, max_bytes)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        
+        if offset and response.status_code != 206:
+            # The server ignored the Range header and is sending the whole file
+            offset = 0
+        
+        content_length = response.headers.get("Content-Length")
+        if content_length and offset + int(content_length) > max_bytes:
+            raise DownloadTooLarge(f"File is {offset + int(content_length)} bytes, limit is {max_bytes}")
+        
+        written = offset
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise DownloadTooLarge(f"File exceeds the limit of {max_bytes} bytes")
+                f.write(chunk)
+
+
+def download_file(url: str, destination_path: str, doc_dir: str = None,
+                  max_bytes: int = DOWNLOAD_MAX_BYTES) -> Tuple[bool, str]:
     """
     Download a file from a URL to the specified destination path.
     If the file already exists, it won't be downloaded again.
     
+    The file is streamed in chunks to a temporary ".part" file over a pooled session and
+    moved into place only once complete. Connection errors and timeouts are retried with
+    exponential backoff, resuming from the bytes already received.
+    
     Args:
         url (str): The URL of the file to download
         destination_path (str): The local path where the file should be saved
         doc_dir (str, optional): The document directory. If provided, it will be created.
+        max_bytes (int, optional): Abort downloads larger than this
         
     Returns:
         Tuple[bool, str]: (Success status, Error message if any)
@@ -60,31 +137,46 @@ def download_file(url: str, destination_path: str, doc_dir: str = None) -> Tuple
     
     # Ensure directory exists
     os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    part_path = f"{destination_path}.part"
     
-    try:
-        logger.info(f"Downloading file from {url}")
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+    for attempt in range(DOWNLOAD_MAX_RETRIES + 1):
+        if attempt:
+            delay = DOWNLOAD_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            logger.info(f"Retrying download in {delay:.1f}s (attempt {attempt + 1}/{DOWNLOAD_MAX_RETRIES + 1})")
+            time.sleep(delay)
         
-        with open(destination_path, "wb") as f:
-            f.write(response.content)
+        try:
+            logger.info(f"Downloading file from {url}")
+            with stage_timer("download"):
+                _download_to(url, part_path, max_bytes)
+            os.replace(part_path, destination_path)
+            logger.info(f"File downloaded successfully to {destination_path}")
+            return True, ""
             
-        logger.info(f"File downloaded successfully to {destination_path}")
-        return True, ""
-        
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except requests.exceptions.ConnectionError as e:
-        error_msg = f"Connection error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except requests.exceptions.Timeout as e:
-        error_msg = f"Timeout error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except Exception as e:
-        error_msg = f"Error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
\ No newline at end of file
+        except DownloadTooLarge as e:
+            error_msg = f"File too large: {str(e)}"
+            logger.error(error_msg)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return False, error_msg
+        except requests.exceptions.HTTPError as e:
+            error_msg = f"HTTP error downloading file: {str(e)}"
+            logger.error(error_msg)
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and status < 500 and status not in (408, 429):
+                return False, error_msg
+        except requests.exceptions.ConnectionError as e:
+            error_msg = f"Connection error downloading file: {str(e)}"
+            logger.error(error_msg)
+        except requests.exceptions.Timeout as e:
+            error_msg = f"Timeout error downloading file: {str(e)}"
+            logger.error(error_msg)
+        except requests.exceptions.ChunkedEncodingError as e:
+            error_msg = f"Connection interrupted downloading file: {str(e)}"
+            logger.error(error_msg)
+        except Exception as e:
+            error_msg = f"Error downloading file: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+    
+    return False, error_msg
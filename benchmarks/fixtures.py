@@ -0,0 +1,137 @@
+"""
+Synthetic fixture corpus for the benchmarks.
+
+Fixtures are generated deterministically so runs are comparable without checking
+large binary files into the repository.
+"""
+import os
+import random
+
+import fitz  # PyMuPDF
+
+TEI_NS = "http://www.tei-c.org/ns/1.0"
+
+# Figure and table positions on generated pages, as fractions of the page size.
+# The stand-in layout model reports exactly these boxes.
+FIGURE_BOX = (0.15, 0.12, 0.85, 0.40)
+FIGURE_CAPTION_BOX = (0.15, 0.41, 0.85, 0.45)
+TABLE_BOX = (0.15, 0.55, 0.85, 0.75)
+TABLE_CAPTION_BOX = (0.15, 0.76, 0.85, 0.80)
+TEXT_BOX = (0.10, 0.82, 0.90, 0.95)
+
+# name -> (divisions, paragraphs per division, refs per paragraph, bibliography entries)
+TEI_CORPUS = {
+    "small": (8, 4, 2, 30),
+    "medium": (30, 8, 4, 120),
+    "large": (120, 12, 6, 600),
+}
+# name -> number of pages; every page has one figure and one table
+PDF_CORPUS = {
+    "small": 4,
+    "medium": 12,
+}
+
+_WORDS = ("model", "layout", "figure", "results", "method", "data", "analysis", "paper",
+          "network", "baseline", "accuracy", "training", "table", "section", "we", "show")
+
+
+def _sentence(rng: random.Random, words: int = 20) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def generate_tei(divisions: int, paragraphs: int, refs: int, bibliography: int, seed: int = 0) -> bytes:
+    """
+    Generate a GROBID-like TEI document with a header, body divisions and a bibliography.
+    """
+    rng = random.Random(seed)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<TEI xml:space="preserve" xmlns="{TEI_NS}">',
+        "<teiHeader><fileDesc><titleStmt><title>Synthetic paper</title></titleStmt></fileDesc></teiHeader>",
+        '<text xml:lang="en"><body>',
+    ]
+    for d in range(divisions):
+        parts.append(f'<div><head n="{d + 1}.">{_sentence(rng, 4)}</head>')
+        for _ in range(paragraphs):
+            text = []
+            for r in range(refs):
+                target = rng.randrange(max(1, bibliography))
+                text.append(f'{_sentence(rng)} <ref type="bibr" target="#b{target}">[{target}]</ref>')
+            parts.append(f"<p>{' '.join(text)} {_sentence(rng)}.</p>")
+        parts.append("</div>")
+        if d % 5 == 0:
+            parts.append(f'<figure xml:id="fig_{d}"><head>Figure {d}</head><figDesc>{_sentence(rng)}</figDesc></figure>')
+    parts.append('</body><back><div type="references"><listBibl>')
+    for b in range(bibliography):
+        parts.append(
+            f'<biblStruct xml:id="b{b}"><analytic><title level="a">{_sentence(rng, 8)}</title>'
+            f'<author><persName><surname>{rng.choice(_WORDS).title()}</surname></persName></author>'
+            f'</analytic><monogr><title level="j">Journal</title><imprint><date when="2020"/></imprint></monogr></biblStruct>'
+        )
+    parts.append("</listBibl></div></back></text></TEI>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def generate_figure_tei(pages: int, width: float = 595, height: float = 842, missed_pages=()) -> bytes:
+    """
+    Generate the TEI GROBID returns with teiCoordinates=figure for a PDF made by
+    generate_pdf: one located figure and one located table per page, except on
+    missed_pages, where GROBID found nothing.
+    """
+    def coords(page, box):
+        x, y = box[0] * width, box[1] * height
+        w, h = (box[2] - box[0]) * width, (box[3] - box[1]) * height
+        return f"{page + 1},{x:.2f},{y:.2f},{w:.2f},{h:.2f}"
+
+    parts = [f'<TEI xmlns="{TEI_NS}"><text><body><div><head>Introduction</head><p>Text.</p></div>']
+    for n in range(pages):
+        if n in missed_pages:
+            continue
+        parts.append(
+            f'<figure xml:id="fig_{n}" coords="{coords(n, FIGURE_BOX)}"><head>Figure {n + 1}</head>'
+            f'<figDesc>Figure {n + 1} caption</figDesc><graphic coords="{coords(n, FIGURE_BOX)}" type="vector"/></figure>'
+        )
+        parts.append(
+            f'<figure type="table" xml:id="tab_{n}" coords="{coords(n, TABLE_BOX)}"><head>Table {n + 1}</head>'
+            f'<figDesc>Table {n + 1} caption</figDesc><table/></figure>'
+        )
+    parts.append("</body></text></TEI>")
+    return "".join(parts).encode("utf-8")
+
+
+def _rect(page, box):
+    w, h = page.rect.width, page.rect.height
+    return fitz.Rect(box[0] * w, box[1] * h, box[2] * w, box[3] * h)
+
+
+def generate_pdf(path: str, pages: int, seed: int = 0):
+    """
+    Generate a PDF with one vector figure and one table per page, each with a caption
+    in the text layer, plus a paragraph of body text.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        figure = _rect(page, FIGURE_BOX)
+        page.draw_rect(figure, color=(0, 0, 0), fill=(0.8, 0.85, 1.0))
+        for _ in range(20):
+            x = figure.x0 + rng.random() * figure.width
+            y = figure.y0 + rng.random() * figure.height
+            page.draw_circle((x, y), 4, color=(0.2, 0.2, 0.6), fill=(0.2, 0.2, 0.6))
+        page.insert_textbox(_rect(page, FIGURE_CAPTION_BOX), f"Figure {n + 1}: {_sentence(rng, 8)}", fontsize=8)
+
+        table = _rect(page, TABLE_BOX)
+        rows, cols = 5, 4
+        for r in range(rows + 1):
+            y = table.y0 + r * table.height / rows
+            page.draw_line((table.x0, y), (table.x1, y))
+        for c in range(cols + 1):
+            x = table.x0 + c * table.width / cols
+            page.draw_line((x, table.y0), (x, table.y1))
+        page.insert_textbox(_rect(page, TABLE_CAPTION_BOX), f"Table {n + 1}: {_sentence(rng, 8)}", fontsize=8)
+
+        page.insert_textbox(_rect(page, TEXT_BOX), _sentence(rng, 60), fontsize=9)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    doc.save(path)
+    doc.close()
@@ -0,0 +1,401 @@
+"""
+Benchmark the TEI extraction and figure pipelines against a synthetic fixture corpus.
+
+Supabase, GROBID and the layout model are replaced by local stand-ins (see stubs.py),
+so the numbers measure our own code: parsing, rendering, cropping, captioning and the
+bookkeeping around them. Each benchmark runs in a fresh forked process so peak RSS is
+reported per benchmark.
+
+Usage, from the repository root:
+    python -m benchmarks.run
+    python -m benchmarks.run --repeat 5 --only tei_parse
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.2
+
+The tei_parse benchmarks also fail if an engine's output differs from the bs4 engine's.
+
+The startup benchmark imports main.py in a fresh interpreter instead, with the real
+dependencies, to catch heavyweight imports creeping back into the import path.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import statistics
+import subprocess
+import multiprocessing
+from collections import defaultdict
+
+# The Supabase client is created on first use; point it somewhere harmless
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_KEY", "benchmark.benchmark.benchmark")
+
+from .fixtures import TEI_CORPUS, PDF_CORPUS, generate_tei, generate_pdf, generate_figure_tei
+from .stubs import FakeSupabase, FakeGrobid, FakeLayoutModel
+
+
+# Service times charged by the stand-ins in the latency benchmarks: one Supabase request
+# or storage upload, one layout model forward pass, and one GROBID fulltext call
+NETWORK_LATENCY = 0.03
+MODEL_LATENCY = 0.05
+GROBID_LATENCY = 1.0
+
+
+class StageTimer:
+    """
+    Accumulates wall time per pipeline stage by wrapping module attributes. Stages
+    running in several threads at once report the sum over all threads.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, name: str, stage: str):
+        original = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.totals[stage] += time.perf_counter() - start
+
+        setattr(owner, name, timed)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _load_app():
+    """
+    Import the app with the stand-in layout model installed. Called once in the parent
+    process, from the repository root, before any benchmark is forked.
+    """
+    from app import layout_service
+    layout_service.layout_service.model_factory = FakeLayoutModel
+
+    from app import extract, pipeline, figure_extractor  # noqa: F401
+    # The app imports BeautifulSoup on first parse; keep that out of the timings
+    import bs4  # noqa: F401
+
+
+def _reset_app(tei_content: bytes) -> FakeSupabase:
+    """
+    Install fresh stand-ins and a cold result cache for one benchmark run.
+    """
+    from app import pipeline, figure_extractor
+    from app.cache import ResultCache
+    from app.grobid import set_grobid_client
+    from app.supabase_client import set_supabase
+
+    fake_supabase = FakeSupabase()
+    set_supabase(fake_supabase)
+    set_grobid_client(FakeGrobid(tei_content))
+
+    cache = ResultCache(tempfile.mkdtemp(prefix="bench-cache-"))
+    pipeline.result_cache = cache
+    figure_extractor.result_cache = cache
+    return fake_supabase
+
+
+def bench_tei_parse(size: str, engine: str) -> dict:
+    from app.extract import parse_tei_divisions
+
+    tei_content = generate_tei(*TEI_CORPUS[size])
+    timer = StageTimer()
+    start = time.perf_counter()
+    divisions = parse_tei_divisions(tei_content, engine=engine)
+    wall_time = time.perf_counter() - start
+    timer.totals["parse"] = wall_time
+
+    # Every engine must produce exactly what the bs4 reference engine does
+    if engine != "bs4":
+        expected = json.dumps(parse_tei_divisions(tei_content, engine="bs4"))
+        if json.dumps(divisions) != expected:
+            raise AssertionError(f"{engine} output differs from bs4 on the {size} fixture")
+    return {
+        "wall_time": wall_time,
+        "stages": dict(timer.totals),
+        "throughput": {"divisions_per_s": len(divisions) / wall_time},
+    }
+
+
+def bench_text_pipeline(size: str, workdir: str) -> dict:
+    tei_content = generate_tei(*TEI_CORPUS[size])
+    fake_supabase = _reset_app(tei_content)
+    from app import pipeline
+
+    paper_id = "00000000-0000-0000-0000-000000000001"
+    pdf_path = os.path.join(workdir, "documents", paper_id, "paper.pdf")
+    generate_pdf(pdf_path, pages=1)
+    row = {"id": paper_id, "pdf_file_path": "https://storage.invalid/paper.pdf"}
+
+    timer = StageTimer()
+    timer.wrap(pipeline, "download_file", "download")
+    timer.wrap(pipeline.get_grobid_client(), "process_fulltext", "grobid")
+    timer.wrap(pipeline, "parse_tei_divisions", "parse")
+    timer.wrap(pipeline, "insert_divisions", "insert")
+
+    start = time.perf_counter()
+    pipeline.process_paper_text(paper_id, row)
+    wall_time = time.perf_counter() - start
+    divisions = len(fake_supabase.inserted.get("PaperContentGrobid", []))
+    return {
+        "wall_time": wall_time,
+        "stages": dict(timer.totals),
+        "throughput": {"divisions_per_s": divisions / wall_time},
+    }
+
+
+def bench_figure_pipeline(size: str, mode: str, latency: bool, grobid_misses: bool, workdir: str) -> dict:
+    pages = PDF_CORPUS[size]
+    # GROBID missing the figures of every other page, which the layout model has to find
+    missed_pages = range(1, pages, 2) if grobid_misses else ()
+    fake_supabase = _reset_app(generate_figure_tei(pages, missed_pages=missed_pages))
+    from app import figure_extractor
+
+    if latency:
+        # Charge the stand-ins a realistic service time, so overlap between stages shows
+        fake_supabase.latency = NETWORK_LATENCY
+        figure_extractor.layout_service.model_factory = lambda: FakeLayoutModel(latency=MODEL_LATENCY)
+
+    paper_id = "00000000-0000-0000-0000-000000000002"
+    generate_pdf(os.path.join(workdir, "documents", paper_id, "paper.pdf"), pages=pages)
+    fake_supabase.papers[paper_id] = {"id": paper_id, "pdf_file_path": "https://storage.invalid/paper.pdf"}
+
+    timer = StageTimer()
+    timer.wrap(figure_extractor, "download_file", "download")
+    timer.wrap(figure_extractor, "render_page", "render")
+    timer.wrap(figure_extractor.layout_service, "detect", "detect")
+    timer.wrap(figure_extractor, "render_region", "crop")
+    timer.wrap(figure_extractor, "extract_region_text", "caption_text")
+    timer.wrap(figure_extractor.upload_pool, "_upload", "upload")
+    timer.wrap(figure_extractor, "_insert_figures", "insert")
+
+    start = time.perf_counter()
+    results = figure_extractor.extract_and_upload_figures(paper_id, mode=mode)
+    wall_time = time.perf_counter() - start
+    # Every fixture page holds one figure and one table, whatever found them
+    if len(results) != 2 * pages:
+        raise AssertionError(f"Extracted {len(results)} figures/tables from {pages} pages, expected {2 * pages}")
+    return {
+        "wall_time": wall_time,
+        "stages": dict(timer.totals),
+        "throughput": {"pages_per_s": pages / wall_time, "figures_per_s": len(results) / wall_time},
+    }
+
+
+def bench_document_pipeline(size: str, combined: bool, workdir: str) -> dict:
+    pages = PDF_CORPUS[size]
+    fake_supabase = _reset_app(generate_tei(*TEI_CORPUS[size]))
+    from app import pipeline, figure_extractor, document
+
+    fake_supabase.latency = NETWORK_LATENCY
+    pipeline.get_grobid_client().latency = GROBID_LATENCY
+    figure_extractor.layout_service.model_factory = lambda: FakeLayoutModel(latency=MODEL_LATENCY)
+
+    paper_id = "00000000-0000-0000-0000-000000000003"
+    generate_pdf(os.path.join(workdir, "documents", paper_id, "paper.pdf"), pages=pages)
+    row = {"id": paper_id, "pdf_file_path": "https://storage.invalid/paper.pdf"}
+    fake_supabase.papers[paper_id] = row
+
+    timer = StageTimer()
+    timer.wrap(pipeline, "download_file", "download")
+    timer.wrap(figure_extractor, "download_file", "download")
+    timer.wrap(pipeline.get_grobid_client(), "process_fulltext", "grobid")
+    timer.wrap(figure_extractor, "process_local_figures", "figures")
+    timer.wrap(document, "process_local_figures", "figures")
+
+    start = time.perf_counter()
+    if combined:
+        figures = document.process_paper(paper_id, row)["figures"]
+    else:
+        # What a client calling /process/{id} and then /images/{id} gets
+        pipeline.process_paper_text(paper_id, row)
+        figures = figure_extractor.extract_and_upload_figures(paper_id)
+    wall_time = time.perf_counter() - start
+    return {
+        "wall_time": wall_time,
+        "stages": dict(timer.totals),
+        "throughput": {"pages_per_s": pages / wall_time, "figures_per_s": len(figures) / wall_time},
+    }
+
+
+# Run in a fresh interpreter from the repository root. main.py uses relative imports,
+# so it is imported as a submodule of the repository directory.
+_STARTUP_SCRIPT = """
+import os, sys, json, time, importlib
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+start = time.perf_counter()
+importlib.import_module(os.path.basename(os.getcwd()) + ".main")
+seconds = time.perf_counter() - start
+heavy = [
+    name for name in ("torch", "detectron2", "layoutparser", "pytesseract", "supabase", "fitz", "PIL", "bs4")
+    if name in sys.modules
+]
+print(json.dumps({"import": seconds, "heavy_modules": heavy}))
+"""
+
+
+def bench_startup() -> dict:
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", _STARTUP_SCRIPT],
+        cwd=repo_dir, capture_output=True, text=True, check=True
+    ).stdout
+    report = json.loads(output.strip().splitlines()[-1])
+    if report["heavy_modules"]:
+        raise RuntimeError(f"Imported at startup: {', '.join(report['heavy_modules'])}")
+    return {
+        "wall_time": report["import"],
+        "stages": {"import": report["import"]},
+        "throughput": {},
+    }
+
+
+BENCHMARKS = {"startup": (bench_startup, (), False)}
+for _size in TEI_CORPUS:
+    for _engine in ("bs4", "iterparse"):
+        BENCHMARKS[f"tei_parse[{_engine},{_size}]"] = (bench_tei_parse, (_size, _engine), False)
+    BENCHMARKS[f"text_pipeline[{_size}]"] = (bench_text_pipeline, (_size,), True)
+for _size in PDF_CORPUS:
+    BENCHMARKS[f"figure_pipeline[{_size}]"] = (bench_figure_pipeline, (_size, "layout", False, False), True)
+    BENCHMARKS[f"figure_pipeline[grobid,{_size}]"] = (bench_figure_pipeline, (_size, "grobid", False, False), True)
+    BENCHMARKS[f"figure_pipeline[grobid-misses,{_size}]"] = (
+        bench_figure_pipeline, (_size, "grobid", False, True), True
+    )
+    BENCHMARKS[f"figure_pipeline[latency,{_size}]"] = (bench_figure_pipeline, (_size, "layout", True, False), True)
+    BENCHMARKS[f"document_pipeline[sequential,{_size}]"] = (bench_document_pipeline, (_size, False), True)
+    BENCHMARKS[f"document_pipeline[{_size}]"] = (bench_document_pipeline, (_size, True), True)
+
+
+def _run_in_child(fn, args, needs_workdir: bool, results):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        if needs_workdir:
+            # Pipelines write under ./documents
+            os.chdir(workdir)
+            args = args + (workdir,)
+        result = fn(*args)
+        result["peak_rss_mb"] = _peak_rss_mb()
+        results.put(result)
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_benchmark(name: str, repeat: int) -> dict:
+    """
+    Run one benchmark `repeat` times, each in a fresh process, and summarize the runs.
+    """
+    fn, args, needs_workdir = BENCHMARKS[name]
+    context = multiprocessing.get_context("fork")
+    runs = []
+    for _ in range(repeat):
+        results = context.Queue()
+        process = context.Process(target=_run_in_child, args=(fn, args, needs_workdir, results))
+        process.start()
+        result = results.get()
+        process.join()
+        if "error" in result:
+            return result
+        runs.append(result)
+
+    def median(values):
+        return statistics.median(values)
+
+    return {
+        "wall_time": median([run["wall_time"] for run in runs]),
+        "wall_time_min": min(run["wall_time"] for run in runs),
+        "stages": {stage: median([run["stages"].get(stage, 0.0) for run in runs]) for stage in runs[0]["stages"]},
+        "throughput": {key: median([run["throughput"][key] for run in runs]) for key in runs[0]["throughput"]},
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "runs": len(runs),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare median wall times against a baseline.
+
+    Returns:
+        list: Names of benchmarks slower than the baseline by more than tolerance
+    """
+    regressions = []
+    print(f"\n{'benchmark':<36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base or "wall_time" not in base or "wall_time" not in result:
+            continue
+        change = result["wall_time"] / base["wall_time"] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<36} {base['wall_time'] * 1000:>8.1f}ms {result['wall_time'] * 1000:>8.1f}ms {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TEI extraction and figure pipelines")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the median is reported")
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--save-baseline", help="Write results as a baseline to this path")
+    parser.add_argument("--baseline", help="Compare against a baseline saved with --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Make the app importable as a top-level package from the repository root
+    sys.path.insert(0, os.getcwd())
+    _load_app()
+
+    results = {}
+    print(f"{'benchmark':<36} {'wall':>10} {'peak rss':>10}  throughput / stages")
+    for name in BENCHMARKS:
+        if args.only and args.only not in name:
+            continue
+        result = run_benchmark(name, args.repeat)
+        results[name] = result
+        if "error" in result:
+            print(f"{name:<36} ERROR {result['error']}")
+            continue
+        throughput = ", ".join(f"{key}={value:.1f}" for key, value in result["throughput"].items())
+        stages = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in result["stages"].items())
+        summary = f"{throughput}; {stages}" if throughput else stages
+        print(f"{name:<36} {result['wall_time'] * 1000:>8.1f}ms {result['peak_rss_mb']:>8.1f}MB  {summary}")
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "benchmarks": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    failed = [name for name, result in results.items() if "error" in result]
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed += compare(results, json.load(f), args.tolerance)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Local stand-ins for Supabase, GROBID and the layout model, so the pipelines can be
+benchmarked without network access or model weights.
+"""
+import time
+import itertools
+import threading
+
+from .fixtures import FIGURE_BOX, FIGURE_CAPTION_BOX, TABLE_BOX, TABLE_CAPTION_BOX, TEXT_BOX
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.rows = None
+        self.filters = {}
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = [value]
+        return self
+
+    def in_(self, column, values):
+        self.filters[column] = list(values)
+        return self
+
+    def gte(self, column, value):
+        return self
+
+    def delete(self):
+        self.rows = []
+        return self
+
+    def insert(self, rows, **kwargs):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    upsert = insert
+
+    def execute(self):
+        time.sleep(self.client.latency)
+        if self.rows is not None:
+            with self.client.lock:
+                inserted = [dict(row, id=next(self.client.ids)) for row in self.rows]
+                self.client.inserted.setdefault(self.table, []).extend(inserted)
+            return _Response(inserted)
+        ids = self.filters.get("id", [])
+        return _Response([self.client.papers[i] for i in ids if i in self.client.papers])
+
+
+class _Bucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def upload(self, path, file, file_options=None):
+        time.sleep(self.client.latency)
+        with self.client.lock:
+            self.client.uploaded_bytes += len(file)
+        return {"Key": path}
+
+    def remove(self, paths):
+        return [{"name": path} for path in paths]
+
+    def get_public_url(self, path):
+        return f"https://storage.invalid/{self.name}/{path}"
+
+
+class _Storage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, name):
+        return _Bucket(self.client, name)
+
+
+class FakeSupabase:
+    """
+    In-memory Supabase client. `papers` maps paper id to its PaperMainStructure row.
+    Every request and upload takes `latency` seconds.
+    """
+
+    def __init__(self, papers: dict = None, latency: float = 0.0):
+        self.papers = papers or {}
+        self.latency = latency
+        self.inserted = {}
+        self.uploaded_bytes = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.storage = _Storage(self)
+
+    def table(self, name):
+        return _Query(self, name)
+
+
+class FakeGrobid:
+    """
+    GROBID adapter stand-in that returns a fixed TEI document after `latency` seconds.
+    """
+
+    grobid_server = "http://grobid.invalid"
+
+    def __init__(self, tei_content: bytes, latency: float = 0.0):
+        self.tei_content = tei_content
+        self.latency = latency
+        self.calls = 0
+
+    def version(self):
+        return "benchmark"
+
+    def process_fulltext(self, pdf_path, tei_coordinates=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.tei_content
+
+
+class FakeBlock:
+    def __init__(self, type, coordinates):
+        self.type = type
+        self.coordinates = tuple(coordinates)
+
+    def scale(self, factor):
+        return FakeBlock(self.type, [c * factor for c in self.coordinates])
+
+
+class FakeLayout(list):
+    def scale(self, factor):
+        return FakeLayout(block.scale(factor) for block in self)
+
+
+class FakeLayoutModel:
+    """
+    Layout model stand-in that reports the figure, table and caption boxes the
+    fixture PDFs are drawn with, scaled to the image it is given. Every forward pass
+    takes `latency` seconds.
+    """
+
+    BOXES = (("Figure", FIGURE_BOX), ("Text", FIGURE_CAPTION_BOX), ("Table", TABLE_BOX),
+             ("Text", TABLE_CAPTION_BOX), ("Text", TEXT_BOX))
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def detect(self, image):
+        time.sleep(self.latency)
+        width, height = image.size
+        return FakeLayout(
+            FakeBlock(block_type, (box[0] * width, box[1] * height, box[2] * width, box[3] * height))
+            for block_type, box in self.BOXES
+        )
@@ -0,0 +1,82 @@
+"""
+Gunicorn configuration for serving the app with several worker processes.
+
+    gunicorn -c gunicorn.conf.py
+
+The app and the layout model are loaded once in the master process and then the
+workers are forked from it, so the model weights are shared copy-on-write instead
+of being loaded again by every worker. Each worker gets an equal share of the cores
+for torch so the workers do not oversubscribe the machine.
+
+Jobs submitted through /jobs are tracked in memory by the worker that accepted
+them, so clients polling /jobs/{job_id} need sticky sessions when WEB_CONCURRENCY > 1.
+"""
+import gc
+import os
+import sys
+import logging
+import tempfile
+import importlib
+
+# main.py uses package-relative imports, so the app is imported as <directory>.main
+# with the parent directory on the path, the same way `fastapi run main.py` resolves it.
+# The working directory stays the repository, where config.json and documents/ live.
+_here = os.path.dirname(os.path.abspath(__file__))
+_package = os.path.basename(_here)
+
+cores = os.cpu_count() or 1
+workers = int(os.environ.get("WEB_CONCURRENCY", str(cores)))
+# Intra-op threads each worker's torch may use
+torch_threads = int(os.environ.get("TORCH_NUM_THREADS", str(max(1, cores // workers))))
+# Load the layout model in the master before forking the workers
+preload_layout_model = os.environ.get("PRELOAD_LAYOUT_MODEL", "1") == "1"
+
+# Thread pools read these when torch and the OCR pool are first imported, which
+# happens in the master before forking
+os.environ.setdefault("OMP_NUM_THREADS", str(torch_threads))
+os.environ.setdefault("MKL_NUM_THREADS", str(torch_threads))
+os.environ.setdefault("OCR_WORKERS", str(max(1, cores // workers // 2)))
+# Metrics are aggregated across workers through files in this directory. It has to
+# be set before prometheus_client is imported.
+if workers > 1:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-"))
+
+wsgi_app = f"{_package}.main:app"
+pythonpath = os.path.dirname(_here)
+chdir = _here
+worker_class = "uvicorn_worker.UvicornWorker"
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+preload_app = True
+# Requests run their blocking work in threads, so the event loop keeps the worker's
+# heartbeat going even while GROBID or the layout model is busy
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("WORKER_GRACEFUL_TIMEOUT", "60"))
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def when_ready(server):
+    # Runs in the master after the app has been imported and before any worker is forked
+    if preload_layout_model:
+        # Also imports PyMuPDF and PIL, which the app only imports once figures are requested
+        figure_extractor = importlib.import_module(f"{_package}.app.figure_extractor")
+        figure_extractor.layout_service.load_model()
+        logger.info("Layout model loaded in the master process")
+    # Move everything loaded so far out of the garbage collector's view, so collections
+    # in the workers do not write to (and so copy) the pages shared with the master
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(torch_threads)
+    logger.info(f"Worker {worker.pid} limited to {torch_threads} torch threads")
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
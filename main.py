@@ -1,26 +1,23 @@
-from grobid_client.grobid_client import GrobidClient
-
-from typing import Union, Tuple
 from uuid import UUID
-import uuid
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
-from bs4 import BeautifulSoup
-import json
-import os
-import requests
-from dotenv import load_dotenv
-from supabase import create_client, Client
-import datetime  
-
-import fitz  # PyMuPDF
-# import cv2
-import numpy as np
-from PIL import Image
-from .app.extract import extract_divs_to_json
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from pydantic import BaseModel
+from typing import List
+import time
+
 from fastapi.middleware.cors import CORSMiddleware
-from .app.figure_extractor import extract_and_upload_figures
-# from app.utilities.uti import download_file,clean_text
+from starlette.concurrency import run_in_threadpool
+from .app.jobs import job_queue, JobQueueFull
+from .app.cache import result_cache
+from .app.metrics import render_metrics, REQUEST_SECONDS
+from .app.pipeline import process_paper_text, download_paper, PipelineError
+from .app.manifest import StageManifest
+from .app.coalesce import coalesced, document_lock
+from .app.batch import iter_process_batch_ndjson
+from .app.readiness import warm_up, WARMUP_ON_STARTUP
+from .app.supabase_client import get_supabase
 
 # Configure logging
 logging.basicConfig(
@@ -30,128 +27,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger('grobid_processor')
 
-load_dotenv()
-
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
-
-def download_file(url: str, destination_path: str, doc_dir: str = None) -> Tuple[bool, str]:
-    """
-    Download a file from a URL to the specified destination path.
-    If the file already exists, it won't be downloaded again.
-    
-    Args:
-        url (str): The URL of the file to download
-        destination_path (str): The local path where the file should be saved
-        doc_dir (str, optional): The document directory. If provided, it will be created.
-        
-    Returns:
-        Tuple[bool, str]: (Success status, Error message if any)
-    """
-    # Create document directory if provided
-    if doc_dir:
-        os.makedirs(doc_dir, exist_ok=True)
-        logger.info(f"Created/verified document directory: {doc_dir}")
-    
-    # Check if file already exists
-    if os.path.exists(destination_path):
-        logger.info(f"File already exists at {destination_path}, skipping download")
-        return True, ""
-    
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-    
-    try:
-        logger.info(f"Downloading file from {url}")
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        
-        with open(destination_path, "wb") as f:
-            f.write(response.content)
-            
-        logger.info(f"File downloaded successfully to {destination_path}")
-        return True, ""
-        
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except requests.exceptions.ConnectionError as e:
-        error_msg = f"Connection error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except requests.exceptions.Timeout as e:
-        error_msg = f"Timeout error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-    except Exception as e:
-        error_msg = f"Error downloading file: {str(e)}"
-        logger.error(error_msg)
-        return False, error_msg
-
-def process_grobid(id: UUID):
+# Concurrent calls with the same arguments, e.g. a retried request, share one run
+@coalesced
+def process_grobid(id: UUID, force: bool = False):
     if not id:
         logger.error("Error: ID is required")
-        return None
+        raise HTTPException(status_code=400, detail="ID is required")
     
-    response = supabase.table("PaperMainStructure").select("*").eq("id", str(id)).execute()
+    response = get_supabase().table("PaperMainStructure").select("*").eq("id", str(id)).execute()
     
     if not response.data:
         logger.error(f"Error: No data found for id: {id}")
-        return None
+        raise HTTPException(status_code=404, detail=f"No data found for id: {id}")
     
     data = response.data[0]
-    pdf_file_path = data.get("pdf_file_path")
-    
-    if not pdf_file_path:
-        logger.error("Error: PDF file path not found in the record")
-        return None
-    
-    # Create directory based on document ID
-    doc_dir = f"./documents/{str(id)}"
-    
-    file_name = os.path.basename(pdf_file_path)
-    local_file_path = os.path.join(doc_dir, file_name)
     
     try:
-        # Download the PDF file
-        download_success, error_message = download_file(pdf_file_path, local_file_path, doc_dir)
-        if not download_success:
-            logger.error(f"Failed to download PDF: {error_message}")
-            return None
-        
-        client = GrobidClient(config_path="./config.json", check_server=False)
-        client.process("processFulltextDocument", doc_dir, output=f"{doc_dir}/", force=True, verbose=True)
-        
-        # Process the TEI output
-        tei_file_path = local_file_path.replace('.pdf', '.grobid.tei.xml')
-        if os.path.exists(tei_file_path):
-            logger.info(f"Processing TEI file: {tei_file_path}")
-            extract_result = extract_divs_to_json(
-                tei_file_path=tei_file_path,
-                paper_summary_id=str(id)
-            )
-            
-            if not extract_result['success']:
-                logger.error(f"Failed to process TEI: {extract_result['message']}")
-                return None
-            
-            return {
-                "message": "PDF processed and data extracted successfully",
-                "data": data,
-                "local_file_path": local_file_path,
-                "extraction_result": extract_result
-            }
-        else:
-            logger.error(f"TEI file not found: {tei_file_path}")
-            return None
-    
+        return process_paper_text(str(id), data, force=force)
     except Exception as e:
         logger.error(f"Error: Failed to process PDF: {str(e)}")
-        return None
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF: {str(e)}")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy resources are loaded on first use unless a warm-up is requested
+    if WARMUP_ON_STARTUP:
+        warm_up.start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -161,89 +65,219 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    start = time.perf_counter()
+
+    def observe(status_code: str):
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status_code
+        ).observe(time.perf_counter() - start)
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        observe("500")
+        raise
+
+    # Stop the clock once the body has been sent, not when the headers go out,
+    # so streamed responses such as /process/batch are timed in full
+    body_iterator = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            observe(str(response.status_code))
+
+    response.body_iterator = observed_body()
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: per-stage latency histograms and processing counters.
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe. Answers 503 while a warm-up is running or after it failed.
+    """
+    status = warm_up.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.post("/warmup", status_code=202)
+async def start_warmup():
+    """
+    Load the layout model and Supabase client in the background ahead of the first
+    /images request. Poll /ready to see when it has finished.
+    """
+    warm_up.start()
+    return warm_up.status()
+
 @app.get("/process/{id}")
-async def process_document(id: str):
+async def process_document(id: str, force: bool = False):
     try:
         document_id = UUID(id)
-        result = process_grobid(document_id)
-        if result:
-            return result
-        else:
-            raise HTTPException(status_code=404, detail="Processing failed")
+        return await run_in_threadpool(process_grobid, document_id, force)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/images/{id}")
-async def process_document_images(id: str, bucket_name: str = "figure-images"):
+@coalesced
+def process_images(document_id: UUID, bucket_name: str = "figure-images", force: bool = False):
     """
     Extract figures and tables from a PDF document and upload them to Supabase storage.
     
     Args:
-        id: The UUID of the paper to process
-        bucket_name: The Supabase storage bucket name (default: "paper-figures")
+        document_id: The UUID of the paper to process
+        bucket_name: The Supabase storage bucket name (default: "figure-images")
+        force: Rerun every stage even if its inputs have not changed
         
     Returns:
         JSON object with extraction results
     """
-    try:
-        document_id = UUID(id)
-        
-        # Check if the document exists in the database
-        response = supabase.table("PaperMainStructure").select("*").eq("id", str(document_id)).execute()
-        if not response.data:
-            raise HTTPException(status_code=404, detail=f"Document with ID {id} not found")
-        
-        # Get the PDF URL from the database
-        pdf_url = response.data[0].get("pdf_file_path")
-        if not pdf_url:
-            raise HTTPException(status_code=404, detail="PDF file path not found in the database record")
-        
-        # Create document directory path
-        doc_dir = f"./documents/{str(document_id)}"
-        
-        # Create the directory if it doesn't exist
-        os.makedirs(doc_dir, exist_ok=True)
-        
+    # Check if the document exists in the database
+    response = get_supabase().table("PaperMainStructure").select("*").eq("id", str(document_id)).execute()
+    if not response.data:
+        raise HTTPException(status_code=404, detail=f"Document with ID {document_id} not found")
+    
+    # Get the PDF URL from the database
+    pdf_url = response.data[0].get("pdf_file_path")
+    if not pdf_url:
+        raise HTTPException(status_code=404, detail="PDF file path not found in the database record")
+    
+    with document_lock(str(document_id)):
         # Download the PDF if needed
-        file_name = os.path.basename(pdf_url)
-        local_file_path = os.path.join(doc_dir, file_name)
-        download_success, error_message = download_file(pdf_url, local_file_path, doc_dir)
-        
-        if not download_success:
-            raise HTTPException(status_code=500, detail=f"Failed to download PDF: {error_message}")
-        
-        # Extract figures and tables and upload them to Supabase
-        logger.info(f"Starting figure and table extraction for document {id}")
-        results = extract_and_upload_figures(str(document_id), bucket_name)
-        
-        if not results:
-            return {
-                "success": False,
-                "message": "No figures or tables were extracted from the document",
-                "document_id": str(document_id),
-                "count": 0
-            }
+        try:
+            local_file_path = download_paper(str(document_id), response.data[0])
+        except PipelineError as e:
+            raise HTTPException(status_code=500, detail=str(e))
         
+        # Extract figures and tables and upload them to Supabase. Imported here, like
+        # process_paper below, so PyMuPDF and PIL are only loaded once figures are requested
+        from .app.figure_extractor import process_local_figures
+        logger.info(f"Starting figure and table extraction for document {document_id}")
+        manifest = StageManifest.for_paper(str(document_id), force=force)
+        results, failed = process_local_figures(str(document_id), local_file_path, manifest, bucket_name)
+    return _figures_response(document_id, results, failed)
+
+def _figures_response(document_id: UUID, results: list, failed: list) -> dict:
+    # failed lists figures that were extracted but could not be added to the database
+    if not results:
         return {
-            "success": True,
-            "message": f"Successfully extracted {len(results)} figures and tables",
+            "success": False,
+            "message": (
+                f"Failed to add {len(failed)} figures and tables to the database" if failed
+                else "No figures or tables were extracted from the document"
+            ),
             "document_id": str(document_id),
-            "count": len(results),
-            "figures": [
-                {
-                    "id": item.get("id"),
-                    "figure_type": item.get("figure_type"),
-                    "figure_id": item.get("figure_id"),
-                    "page_number": item.get("page_number"),
-                    "head": item.get("head", "")[:100] + ("..." if len(item.get("head", "")) > 100 else ""),  # Truncate long headings
-                    "image_url": item.get("image_url")
-                }
-                for item in results
-            ]
+            "count": 0,
+            "failed": failed
         }
+    
+    return {
+        "success": True,
+        "message": f"Successfully extracted {len(results)} figures and tables"
+                   + (f", {len(failed)} could not be added to the database" if failed else ""),
+        "document_id": str(document_id),
+        "count": len(results),
+        "failed": failed,
+        "figures": [
+            {
+                "id": item.get("id"),
+                "figure_type": item.get("figure_type"),
+                "figure_id": item.get("figure_id"),
+                "page_number": item.get("page_number"),
+                "head": item.get("head", "")[:100] + ("..." if len(item.get("head", "")) > 100 else ""),  # Truncate long headings
+                "image_url": item.get("image_url")
+            }
+            for item in results
+        ]
+    }
+
+@coalesced
+def process_full_document(document_id: UUID, bucket_name: str = "figure-images", force: bool = False):
+    """
+    Extract the text and the figures and tables of a PDF document in one go.
+    The PDF is looked up and downloaded once, and both pipelines run concurrently.
+    
+    Args:
+        document_id: The UUID of the paper to process
+        bucket_name: The Supabase storage bucket name (default: "figure-images")
+        force: Rerun every stage even if its inputs have not changed
+        
+    Returns:
+        JSON object with the text and figure extraction results
+    """
+    response = get_supabase().table("PaperMainStructure").select("*").eq("id", str(document_id)).execute()
+    if not response.data:
+        raise HTTPException(status_code=404, detail=f"Document with ID {document_id} not found")
+    if not response.data[0].get("pdf_file_path"):
+        raise HTTPException(status_code=404, detail="PDF file path not found in the database record")
+    
+    from .app.document import process_paper
+    try:
+        result = process_paper(str(document_id), response.data[0], bucket_name, force=force)
+    except PipelineError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    text = result["text"]
+    figures = _figures_response(document_id, result["figures"], result["figures_failed"])
+    if result["figures_error"]:
+        figures["message"] = f"Figure extraction failed: {result['figures_error']}"
+    return {
+        "success": text is not None and figures["success"],
+        "document_id": str(document_id),
+        "text": {
+            "success": text is not None,
+            "message": text["extraction_result"]["message"] if text else result["text_error"],
+            "division_count": text["division_count"] if text else 0
+        },
+        "figures": figures
+    }
+
+class BatchRequest(BaseModel):
+    ids: List[str]
+
+@app.post("/process/batch")
+async def process_documents_batch(request: BatchRequest):
+    """
+    Process many papers in one call. Results are streamed back as NDJSON,
+    one line per paper in completion order.
+    """
+    try:
+        ids = [str(UUID(id)) for id in request.ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    return StreamingResponse(iter_process_batch_ndjson(ids), media_type="application/x-ndjson")
+
+@app.get("/images/{id}")
+async def process_document_images(id: str, bucket_name: str = "figure-images", force: bool = False):
+    """
+    Extract figures and tables from a PDF document and upload them to Supabase storage.
+    
+    Args:
+        id: The UUID of the paper to process
+        bucket_name: The Supabase storage bucket name (default: "figure-images")
+        force: Rerun every stage even if its inputs have not changed
         
+    Returns:
+        JSON object with extraction results
+    """
+    try:
+        document_id = UUID(id)
+        return await run_in_threadpool(process_images, document_id, bucket_name, force)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid UUID format")
     except HTTPException as e:
@@ -252,3 +286,89 @@ async def process_document_images(id: str, bucket_name: str = "figure-images"):
         logger.error(f"Error processing images: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/document/{id}")
+async def process_full_document_endpoint(id: str, bucket_name: str = "figure-images", force: bool = False):
+    """
+    Extract the text and the figures and tables of a PDF document. Does the work of
+    /process/{id} and /images/{id} together, with a single download.
+    
+    Args:
+        id: The UUID of the paper to process
+        bucket_name: The Supabase storage bucket name (default: "figure-images")
+        force: Rerun every stage even if its inputs have not changed
+        
+    Returns:
+        JSON object with the text and figure extraction results
+    """
+    try:
+        document_id = UUID(id)
+        return await run_in_threadpool(process_full_document, document_id, bucket_name, force)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error processing document: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _submit_job(job_type: str, fn, *args):
+    try:
+        job_id = job_queue.submit(job_type, fn, *args)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}"
+    }
+
+@app.post("/jobs/process/{id}", status_code=202)
+async def submit_process_job(id: str, force: bool = False):
+    """
+    Queue a GROBID text extraction job and return its job id immediately.
+    """
+    try:
+        document_id = UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    return _submit_job("process", process_grobid, document_id, force)
+
+@app.post("/jobs/images/{id}", status_code=202)
+async def submit_images_job(id: str, bucket_name: str = "figure-images", force: bool = False):
+    """
+    Queue a figure and table extraction job and return its job id immediately.
+    Pages from concurrent jobs are batched by the shared layout service.
+    """
+    try:
+        document_id = UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    return _submit_job("images", process_images, document_id, bucket_name, force)
+
+@app.post("/jobs/document/{id}", status_code=202)
+async def submit_document_job(id: str, bucket_name: str = "figure-images", force: bool = False):
+    """
+    Queue a combined text and figure extraction job and return its job id immediately.
+    """
+    try:
+        document_id = UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    return _submit_job("document", process_full_document, document_id, bucket_name, force)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Report result cache size, hit rate and evictions.
+    """
+    return result_cache.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Poll the status of a queued job. The result is included once the job has succeeded.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job